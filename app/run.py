@@ -1,19 +1,24 @@
 
 import os
-from src.cli import parser
+from src.cli import parser, INPUT_DATA_DIR
 from pathlib import Path
 
-from src.suitability_assessment import (SlopeConfig, HANDConfig,
-                                        CoverTypeConfig,
-                                        Project)
-
 #PROJ_DIR = Path("/app/output")
 PROJ_DIR = os.getenv('OUTPUT_DIR', './output')
-INPUT_DATA_DIR = os.getenv('INPUT_DIR', './input')
+
+# the input dir is read once, by the cli module, so both see the same one
+_INPUT = Path(INPUT_DATA_DIR)
+_PROJ = Path(PROJ_DIR)
 
 
 def main(args):
 
+    # imported here so that parsing the arguments (or printing the help) does
+    # not need to load the geospatial libraries
+    from src.suitability_assessment import (SlopeConfig, HANDConfig,
+                                            CoverTypeConfig,
+                                            Project)
+
     cover_config = CoverTypeConfig(
         low_suitability_covers=args.low_suit_cover_types,
         medium_suitability_covers=args.medium_suit_cover_types,
@@ -30,18 +35,18 @@ def main(args):
 
     land_obj = Project(project_name=args.project_name,
                        project_year=args.project_year,
-                       aoi_path=Path(INPUT_DATA_DIR).joinpath(args.aoi_file_name),
+                       aoi_path=_INPUT / args.aoi_file_name,
                        io=args.io,
                        db_config=None,
                        country_code=args.country_code,
                        sub_region=args.sub_region,
                        years_prior=args.years_prior,
                        epsg=args.epsg,
-                       project_dir=Path(PROJ_DIR),
+                       project_dir=_PROJ,
                        intermediate_results_path=None,
                        data_dir=None,
-                       administrative_borders_path=Path(INPUT_DATA_DIR).joinpath(args.admin_border),
-                       protected_areas_path=Path(INPUT_DATA_DIR).joinpath(args.protected_areas),
+                       administrative_borders_path=_INPUT / args.admin_border,
+                       protected_areas_path=_INPUT / args.protected_areas,
                        results_file_path=None
                        )
 
@@ -19,9 +19,9 @@ land_covers = {0: "No Data",
                10: 'Clouds',
                11: 'Rangeland'}
 
-land_covers_str = "Land cover types in MS Planetary Computer:\n"
-for key, value in land_covers.items():
-    land_covers_str += f"    {key}: {value}"
+land_covers_str = ("Land cover types in MS Planetary Computer:\n" +
+                   "\n".join(f"    {key}: {value}"
+                             for key, value in land_covers.items()))
 
 default_slope_suitability_config = ("Default_configuration: "
                                     "low suitability slopes: < 1%% and > 5%%, "
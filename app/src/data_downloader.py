@@ -1,15 +1,76 @@
-from typing import List
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, TYPE_CHECKING
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import HTTPError, RequestException
+from urllib3.util.retry import Retry
 from typing import Union
 from pathlib import Path
 
-from pystac_client import Client
-import planetary_computer
-import geopandas as gpd
-
 from .logging_config import logger
 
+# pystac_client, planetary_computer and geopandas are slow to import, so they
+# are only imported when data is actually searched for or downloaded
+if TYPE_CHECKING:
+    import geopandas as gpd
+    from pystac_client import Client
+
+# number of files downloaded concurrently (e.g. several land cover years,
+# the DEM and the HAND data), further downloads wait for a free slot
+MAX_CONCURRENT_DOWNLOADS = 4
+# number of byte ranges fetched concurrently for a single file
+DOWNLOAD_WORKERS = 8
+# size of each of the byte ranges requested to the server
+DOWNLOAD_PART_SIZE = 4 * 1024 * 1024
+# chunk size used when the server does not accept range requests
+STREAM_CHUNK_SIZE = 4 * 1024 * 1024
+
+# (connect, read) timeouts of the downloads, in seconds
+REQUEST_TIMEOUT = (10, 30)
+
+# session shared by all catalog searches and downloads, so that connections
+# are kept alive (and TLS handshakes are not repeated) between requests. The
+# pool holds a connection for every byte range of the concurrent downloads,
+# so none is discarded when they finish
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=MAX_CONCURRENT_DOWNLOADS * DOWNLOAD_WORKERS,
+    max_retries=Retry(total=3, backoff_factor=0.3)))
+
+# limits the concurrent downloads, whichever thread pool they are run from
+_download_slots = threading.BoundedSemaphore(MAX_CONCURRENT_DOWNLOADS)
+
+
+def _preallocate(fd: int, size: int):
+    """
+    Reserves size bytes for the file at once, to avoid its fragmentation.
+    This is only an optimization, so it is skipped where posix_fallocate is
+    not available (e.g. macOS) or not supported by the filesystem.
+    """
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError):
+        pass
+
+
+@lru_cache(maxsize=8)
+def _open_catalog(client: str, modifier=None) -> "Client":
+    """
+    Opens the STAC catalog only once per (url, modifier) pair, reusing the
+    shared session for all its requests.
+    """
+    from pystac_client import Client
+    from pystac_client.stac_api_io import StacApiIO
+
+    stac_io = StacApiIO(max_retries=None)
+    stac_io.session = _session
+    return Client.open(client, modifier=modifier, stac_io=stac_io)
+
 
 class DataDownloader():
 
@@ -21,16 +82,19 @@ class DataDownloader():
         self.data_dir.mkdir(parents=True, exist_ok=True)
 
     @staticmethod
-    def get_border(country_code: str, region_border_path) -> gpd.GeoDataFrame:
+    def get_border(country_code: str, region_border_path) -> "gpd.GeoDataFrame":
 
         url = f"https://geodata.ucdavis.edu/gadm/gadm4.1/json/gadm41_{country_code}_1.json"
 
         # Load the data into a GeoDataFrame
         try:
-            response = requests.get(url)
-            response.raise_for_status()  # This will raise an HTTPError if the HTTP request returned an unsuccessful status code
-            with open(region_border_path, 'wb') as f:
-                f.write(response.content)
+            with _session.get(url, stream=True,
+                              timeout=REQUEST_TIMEOUT) as response:
+                response.raise_for_status()  # This will raise an HTTPError if the HTTP request returned an unsuccessful status code
+                # undo any gzip transfer encoding while streaming to disk
+                response.raw.decode_content = True
+                with open(region_border_path, 'wb') as f:
+                    shutil.copyfileobj(response.raw, f, length=1024 * 1024)
         except HTTPError as e:
             raise HTTPError(f"HTTPError: {e}")
         except RequestException as e:
@@ -43,14 +107,11 @@ class DataDownloader():
     @staticmethod
     def search_items_from_stac_catalog(client,
                                        collections,
-                                       bbox: gpd.GeoDataFrame,
+                                       bbox: "gpd.GeoDataFrame",
                                        modifier=None,
                                        date=None):
 
-        catalog = Client.open(
-            client,
-            modifier=modifier,
-        )
+        catalog = _open_catalog(client, modifier)
 
         search = catalog.search(
             collections=collections,
@@ -68,24 +129,95 @@ class DataDownloader():
 
         return items
 
+    @staticmethod
+    def _parallel_download(item_url, result_path,
+                           workers: int = DOWNLOAD_WORKERS,
+                           part_size: int = DOWNLOAD_PART_SIZE) -> bool:
+        """
+        Downloads the file in byte ranges that are fetched concurrently and
+        written at their offset of a preallocated file.
+
+        Returns:
+            bool: False if the server does not accept range requests (nothing
+            is downloaded in that case), True otherwise.
+        """
+        head = _session.head(item_url, allow_redirects=True,
+                             timeout=REQUEST_TIMEOUT)
+        size = int(head.headers.get("Content-Length", 0))
+
+        if (head.status_code != 200 or not size or
+                head.headers.get("Accept-Ranges") != "bytes"):
+            return False
+
+        byte_ranges = [(start, min(start + part_size, size) - 1)
+                       for start in range(0, size, part_size)]
+
+        fd = os.open(result_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+
+        def fetch(byte_range):
+            start, end = byte_range
+            response = _session.get(item_url,
+                                    headers={"Range": f"bytes={start}-{end}"},
+                                    timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise HTTPError(f"Range request not honored for {item_url}")
+            if len(response.content) != end - start + 1:
+                raise HTTPError(f"Incomplete range {start}-{end} received "
+                                f"for {item_url}")
+            os.pwrite(fd, response.content, start)
+
+        try:
+            _preallocate(fd, size)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(fetch, byte_ranges))
+        except Exception:
+            # do not leave a partially downloaded file behind
+            Path(result_path).unlink(missing_ok=True)
+            raise
+        finally:
+            os.close(fd)
+
+        return True
+
     @staticmethod
     def download_items_from_stac_catalog(item_url, result_path):
 
         logger.info(f"Found data at URL: {item_url}")
 
-        response = requests.get(item_url, stream=True)
+        with _download_slots:
+            DataDownloader._download(item_url, result_path)
+
+    @staticmethod
+    def _download(item_url, result_path):
+
+        if DataDownloader._parallel_download(item_url, result_path):
+            logger.info(f"File downloaded and saved as {result_path}")
+            return
+
+        response = _session.get(item_url, stream=True,
+                                timeout=REQUEST_TIMEOUT)
 
         if response.status_code == 200:
+            size = int(response.headers.get("Content-Length", 0))
             # Write the file to the local filesystem
             with open(result_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
+                if size:
+                    # reserve the whole file at once, to avoid fragmentation
+                    _preallocate(f.fileno(), size)
+                for chunk in response.iter_content(
+                        chunk_size=STREAM_CHUNK_SIZE):
                     f.write(chunk)
+                # Content-Length is the encoded size if the content was
+                # compressed, so drop anything allocated beyond the data
+                f.truncate()
             logger.info(f"File downloaded and saved as {result_path}")
         else:
             logger.error(f"Failed to download file. Status code: {response.status_code}")
 
     @staticmethod
     def get_dem_planetary_computer(bbox, result_path: Union[str, Path]):
+        import planetary_computer
 
         client = "https://planetarycomputer.microsoft.com/api/stac/v1"
         collections = ["cop-dem-glo-30"]
@@ -133,6 +265,26 @@ class DataDownloader():
 
             DataDownloader.download_items_from_stac_catalog(item_url, land_cover_path)
 
+    @staticmethod
+    def get_land_cover_data_multi(bbox,
+                                  year_to_path: Dict[int, Union[str, Path]]):
+        """
+        Downloads the land cover data of several years concurrently (one
+        thread per year), since each download is bound by network latency.
+        """
+        if not year_to_path:
+            return
+
+        with ThreadPoolExecutor(max_workers=min(len(year_to_path),
+                                                MAX_CONCURRENT_DOWNLOADS)
+                                ) as executor:
+            futures = [executor.submit(DataDownloader.get_land_cover_data,
+                                       bbox, year, path)
+                       for year, path in year_to_path.items()]
+            # re-raise any error that occurred during the downloads
+            for future in futures:
+                future.result()
+
     @staticmethod
     def get_protected_areas(country_code: str, result_path: Union[str, Path]):
         raise NotImplementedError("I cannot download protected areas yet!")
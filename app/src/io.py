@@ -1,20 +1,112 @@
 
 import json
+import math
+import os
+import threading
 from abc import ABC, abstractmethod
-from pathlib import Path
+from collections import defaultdict
 from dataclasses import asdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
-from typing import Union
+from typing import Iterable, Optional, Set, Union, TYPE_CHECKING
 
 # import psycopg2
 # from psycopg2.extras import RealDictCursor
-import rioxarray as rxr
-import geopandas as gpd
-import numpy as np
+import orjson
+
+# the geospatial libraries are slow to import, so they are only imported
+# when a raster or vector is actually read or written
+if TYPE_CHECKING:
+    import geopandas as gpd
 
 from .io_vector import FileReader
 from .tools import add_word_to_filename
 
+# target size (in pixels) of the dask chunks used to read rasters lazily
+DEFAULT_CHUNKS = {'x': 512, 'y': 512}
+
+# rasters are written tiled, with tiles of the size of the default chunks, so
+# that reading them back chunk by chunk never reads a tile twice
+RASTER_CREATION_OPTIONS = {'tiled': True,
+                           'blockxsize': DEFAULT_CHUNKS['x'],
+                           'blockysize': DEFAULT_CHUNKS['y'],
+                           'compress': 'ZSTD',
+                           # faster to encode than the default level (9), and
+                           # barely larger for these rasters
+                           'zstd_level': 3,
+                           'num_threads': 'ALL_CPUS',
+                           'BIGTIFF': 'IF_SAFER'}
+
+# decimation factors of the overviews built for the rasters that are viewed
+# (e.g. the final result), so they can be previewed with read_raster
+OVERVIEW_FACTORS = [2, 4, 8, 16]
+
+# GDAL configuration used to read and write rasters (unless already set in
+# the environment): a larger block cache, multithreaded (de)compression, and
+# cached, chunked HTTP reads that do not list remote directories on open
+GDAL_CONFIG = {'GDAL_CACHEMAX': '2048',
+               'GDAL_NUM_THREADS': 'ALL_CPUS',
+               'VSI_CACHE': 'TRUE',
+               'CPL_VSIL_CURL_CHUNK_SIZE': '8388608',
+               'GDAL_HTTP_MULTIPLEX': 'YES',
+               'GDAL_DISABLE_READDIR_ON_OPEN': 'EMPTY_DIR'}
+
+
+def _tile_chunks(path, chunks: Optional[dict] = None) -> dict:
+    """
+    Returns the dask chunks to read the raster with: the requested chunk
+    sizes (DEFAULT_CHUNKS if not passed) rounded to a multiple of the
+    internal tile (or strip) shape of the file, so that chunks never split a
+    tile, and every tile is read exactly once.
+    """
+    import rasterio
+
+    chunks = chunks or DEFAULT_CHUNKS
+
+    with rasterio.open(path) as src:
+        block_y, block_x = src.block_shapes[0]
+
+    return {'x': max(1, round(chunks['x'] / block_x)) * block_x,
+            'y': max(1, round(chunks['y'] / block_y)) * block_y}
+
+
+def _predictor(dtype) -> int:
+    """
+    Returns the TIFF predictor that suits the data type: floating point
+    prediction for floats, and horizontal differencing for integers (libtiff
+    does not support it for 64 bit integers).
+    """
+    import numpy as np
+
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'f':
+        return 3
+    return 2 if dtype.itemsize < 8 else 1
+
+
+def _has_non_finite(value) -> bool:
+    """
+    Whether value, or any value nested in its dicts, lists and tuples, is a
+    NaN or infinite number.
+    """
+    if isinstance(value, dict):
+        return any(map(_has_non_finite, value.values()))
+    if isinstance(value, (list, tuple)):
+        return any(map(_has_non_finite, value))
+    try:
+        return not math.isfinite(value)
+    except TypeError:
+        return False
+
+
+def _to_builtin(value):
+    """Converts numpy scalars and arrays, which json cannot serialize."""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON "
+                    "serializable")
+
 
 # Abstract Base Class for Data Handlers
 class DataHandler(ABC):
@@ -22,6 +114,10 @@ class DataHandler(ABC):
     def read_raster(self, path):
         pass
 
+    @abstractmethod
+    def read_raster_bounds(self, path):
+        pass
+
     @abstractmethod
     def write_raster(self, path, data):
         pass
@@ -42,6 +138,10 @@ class DataHandler(ABC):
     def address_exists(self, address):
         pass
 
+    @abstractmethod
+    def list_existing_paths(self, paths):
+        pass
+
     @abstractmethod
     def ensure_addresses_exist(self, *args, **kwargs):
         raise NotImplementedError
@@ -49,22 +149,117 @@ class DataHandler(ABC):
 
 # Concrete class for Disk operations
 class DiskHandler(DataHandler):
-    def read_raster(self, path):
-        return rxr.open_rasterio(path, masked=True).squeeze()
+    def __init__(self):
+        # GDAL reads its configuration from the environment
+        for option, value in GDAL_CONFIG.items():
+            os.environ.setdefault(option, value)
+
+    def read_raster(self, path, chunks: Optional[dict] = None,
+                    preserve_dtype: bool = False,
+                    overview_level: Optional[int] = None):
+        """
+        Opens the raster lazily, as a dask array split in chunks aligned
+        with the internal blocks of the file, so data is only read (tile by
+        tile) when it is actually needed.
+
+        If overview_level is passed, that (decimated) overview of the file is
+        read instead of the full resolution data, e.g. for previews.
+
+        By default nodata values are masked as NaN, which upcasts integer
+        rasters to floats. With preserve_dtype=True the data keeps its native
+        data type (e.g. uint8 for land cover), and a (data, valid_mask) tuple
+        is returned instead, valid_mask being False wherever data is nodata.
+        """
+        import rioxarray as rxr
+
+        xds = rxr.open_rasterio(path, masked=not preserve_dtype,
+                                mask_and_scale=False,
+                                overview_level=overview_level,
+                                chunks=_tile_chunks(path, chunks),
+                                lock=False, cache=False)
+        # single band rasters are returned as 2D (y, x) arrays
+        if xds.sizes.get('band') == 1:
+            xds = xds.isel(band=0, drop=True)
+
+        if not preserve_dtype:
+            return xds
+
+        nodata = xds.rio.nodata
+        if nodata is None or math.isnan(nodata):
+            valid_mask = xds.notnull()
+        else:
+            valid_mask = xds != nodata
+        return xds, valid_mask
+
+    def read_raster_bounds(self, path):
+        """
+        Returns the bounds and CRS of the raster, reading only its header.
+        """
+        import rasterio
 
-    def write_raster(self, path, data, nodata=np.nan, metadata=None):
-        data.rio.to_raster(path, nodata=nodata, metadata=metadata)
+        with rasterio.open(path) as src:
+            return src.bounds, src.crs
+
+    def write_raster(self, path, data, nodata=math.nan, metadata=None,
+                     overviews: bool = False, windowed: bool = False):
+        """
+        Writes the raster as a tiled, compressed GeoTIFF. With overviews=True
+        (nearest neighbour) overviews are added to the file, so it can be
+        read at a lower resolution with the overview_level of read_raster.
+
+        With windowed=True lazy (dask) data is never held in memory whole:
+        its chunks are computed in parallel and written one at a time, as
+        they are computed. Other data is written tile by tile.
+        """
+        from dask import is_dask_collection
+
+        # the data type the raster will be written with
+        dtype = data.encoding.get('rasterio_dtype',
+                                  data.encoding.get('dtype', data.dtype))
+        # with a lock, rioxarray stores dask chunks with dask.array.store
+        lock = (threading.Lock()
+                if windowed and is_dask_collection(data.data) else None)
+        data.rio.to_raster(path, nodata=nodata, metadata=metadata,
+                           predictor=_predictor(dtype), windowed=windowed,
+                           lock=lock, **RASTER_CREATION_OPTIONS)
+
+        if overviews:
+            import rasterio
+            from rasterio.enums import Resampling
+
+            with rasterio.open(path, 'r+') as dst:
+                dst.build_overviews(OVERVIEW_FACTORS, Resampling.nearest)
+                dst.update_tags(ns='rio_overview', resampling='nearest')
 
     def read_vector(self, path):
         reader = FileReader(path)
         return reader.read()
 
-    def write_vector(self, path: Union[str, Path], data: gpd.GeoDataFrame):
-        data.to_file(path, driver='GeoJSON')
+    def write_vector(self, path: Union[str, Path], data: "gpd.GeoDataFrame"):
+        """
+        Writes the vector as GeoParquet if the path has a .parquet suffix,
+        else as GeoJSON.
+        """
+        if Path(path).suffix.lower() == '.parquet':
+            # the bbox covering column allows filtering rows by extent on read
+            data.to_parquet(path, compression='zstd', write_covering_bbox=True)
+        else:
+            data.to_file(path, driver='GeoJSON', engine='pyogrio')
 
     def write_stats(self, stats):
-        with open(self.stats_path, 'w') as json_file:
-            json.dump(asdict(stats), json_file, indent=4)
+        # orjson serializes the dataclass (and numpy scalars) natively, but
+        # it writes NaN as null, so stats with NaNs (e.g. of an empty
+        # selection) are written with json, as NaN
+        if _has_non_finite(asdict(stats)):
+            with open(self.stats_path, 'w') as json_file:
+                json.dump(asdict(stats), json_file, indent=2,
+                          default=_to_builtin)
+            return
+
+        with open(self.stats_path, 'wb') as json_file:
+            json_file.write(orjson.dumps(stats,
+                                         option=orjson.OPT_INDENT_2 |
+                                         orjson.OPT_SERIALIZE_NUMPY))
 
     def ensure_addresses_exist(self, *args, **kwargs):
 
@@ -82,79 +277,98 @@ class DiskHandler(DataHandler):
         # create project folder and data folder inside
         self.project_dir = (Path(project_dir)
                             if project_dir
-                            else self.aoi_dir.joinpath(self.project_name))
+                            else self.aoi_dir / self.project_name)
 
         self.data_dir = (Path(data_dir)
                          if data_dir
-                         else self.project_dir.joinpath("data"))
-        self.results_dir = self.project_dir.joinpath("results")
+                         else self.project_dir / "data")
+        self.results_dir = self.project_dir / "results"
         self.intermediate_results_dir = (Path(intermediate_data_dir)
                                          if intermediate_data_dir
-                                         else self.project_dir.joinpath(
-                                             "intermediate_results"))
+                                         else self.project_dir /
+                                         "intermediate_results")
 
-        self.stats_path = self.results_dir.joinpath("stats.json")
+        self.stats_path = self.results_dir / "stats.json"
         self.protected_areas_path = (
             Path(protected_areas_dir) if protected_areas_dir
-            else self.project_dir.joinpath(
-             f"protected_areas_{self.country_code}.geojson"
-            )
+            else self.project_dir /
+            f"protected_areas_{self.country_code}.geojson"
         )
 
         self.region_border_path = (
             Path(administrative_borders_dir)
             if administrative_borders_dir
-            else self.project_dir.joinpath(
-                f"admin_border_{self.country_code}.geojson")
+            else self.project_dir /
+            f"admin_border_{self.country_code}.geojson"
             )
 
         self.analysis_output_path = (Path(results_dir)
                                      if results_dir
-                                     else self.results_dir.joinpath(
-                                         'classified_land.tif')
+                                     else self.results_dir /
+                                     'classified_land.tif'
                                      )
 
-        self.dem_file_path = self.data_dir.joinpath("dem.tif")
-        self.dem_file_path_projected = self.intermediate_results_dir.joinpath(
-            "dem_processed.tif")
+        self.dem_file_path = self.data_dir / "dem.tif"
+        self.dem_file_path_projected = (self.intermediate_results_dir /
+                                        "dem_processed.tif")
 
-        self.land_cover_paths = {
-                year: self.data_dir.joinpath(f"lc_{year}.tif")
-                for year in years}
+        self.land_cover_paths, self.land_cover_paths_projected = (
+            {year: self.data_dir / f"lc_{year}.tif" for year in years},
+            {year: self.intermediate_results_dir / f"lc_{year}_processed.tif"
+             for year in years})
 
-        self.land_cover_paths_projected = {
-            year: self.intermediate_results_dir.joinpath(
-                f"lc_{year}_processed.tif")
-            for year, path in self.land_cover_paths.items()}
-
-        self.hand_file_path = self.data_dir.joinpath("hand.tif")
+        self.hand_file_path = self.data_dir / "hand.tif"
         self.hand_file_path_projected = \
-            self.intermediate_results_dir.joinpath("hand_processed.tif")
+            self.intermediate_results_dir / "hand_processed.tif"
         self.reclassified_hand_result_path = \
             add_word_to_filename(
                 self.hand_file_path_projected, "reclassified")
 
-        self.slope_path = self.intermediate_results_dir.joinpath("slope.tif")
+        self.slope_path = self.intermediate_results_dir / "slope.tif"
         self.reclassified_slope_path = \
             add_word_to_filename(self.slope_path, "reclassified")
 
-        self.result_land_cover_path = self.intermediate_results_dir.joinpath(
-            "land_cover_intersect.tif")
+        self.result_land_cover_path = (self.intermediate_results_dir /
+                                       "land_cover_intersect.tif")
         self.result_land_cover_path_reclassified = \
             add_word_to_filename(
                 self.result_land_cover_path, "reclassified")
 
-        self.remaining_land_projected_path = self.results_dir.joinpath(
-            "remaining_land.geojson")
+        self.remaining_land_projected_path = (self.results_dir /
+                                              "remaining_land.parquet")
 
     def _create_dirs(self):
-        self.data_dir.mkdir(parents=True, exist_ok=True)
-        self.results_dir.mkdir(parents=True, exist_ok=True)
-        self.intermediate_results_dir.mkdir(parents=True, exist_ok=True)
+        dirs = (self.data_dir, self.results_dir, self.intermediate_results_dir)
+        # created concurrently, since on network mounts each mkdir is a round
+        # trip to the server
+        with ThreadPoolExecutor(max_workers=len(dirs)) as executor:
+            list(executor.map(
+                lambda path: path.mkdir(parents=True, exist_ok=True), dirs))
 
     def address_exists(self, address: Path) -> bool:
         return address.exists()
 
+    def list_existing_paths(self, paths: Iterable[Path]) -> Set[Path]:
+        """
+        Returns the paths that exist, listing each of their directories once
+        instead of checking the paths one by one.
+        """
+        paths_by_dir = defaultdict(set)
+        for path in paths:
+            path = Path(path)
+            paths_by_dir[path.parent].add(path)
+
+        existing = set()
+        for directory, dir_paths in paths_by_dir.items():
+            try:
+                with os.scandir(directory) as entries:
+                    names = {entry.name for entry in entries}
+            except FileNotFoundError:
+                continue
+            existing.update(path for path in dir_paths if path.name in names)
+
+        return existing
+
 
 # Concrete class for Database operations
 class DbHandler(DataHandler):
@@ -169,6 +383,11 @@ class DbHandler(DataHandler):
         # return self.cursor.fetchone()['raster_data']
         pass
 
+    def read_raster_bounds(self, path):
+        # Implement logic to read the raster extent from the database
+        # self.cursor.execute("SELECT ST_Envelope(raster_data), ST_SRID(raster_data) FROM rasters WHERE path = %s", (path,))
+        pass
+
     def write_raster(self, path, data):
         # Implement logic to write raster to the database
         """
@@ -200,6 +419,11 @@ class DbHandler(DataHandler):
     def write_stats(self):
         pass
 
+    def list_existing_paths(self, paths):
+        # Implement logic to list the stored paths with a single query
+        # self.cursor.execute("SELECT path FROM rasters WHERE path = ANY(%s)", (list(map(str, paths)),))
+        pass
+
     def ensure_addresses_exist(self, *args, **kwargs):
         pass
 
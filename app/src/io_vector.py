@@ -3,118 +3,171 @@
 Handle all these file formats: GeoParquet, ESRI Shapefile, GeoJSON, KML
 """
 
-from abc import ABC, abstractmethod
-import geopandas as gpd
-from fastkml import kml
-from shapely.geometry import shape
-from typing import Union, Type
+from typing import Callable, Dict, Union, Optional, TYPE_CHECKING
 from pathlib import Path
 
 from .logging_config import logger
 
+# geopandas, lxml and shapely are slow to import, so they are only imported
+# by the readers that need them
+if TYPE_CHECKING:
+    import geopandas as gpd
+    from shapely.geometry.base import BaseGeometry
 
-class GeoDataHandler(ABC):
-    def __init__(self, file_path: Path):
-        self._data = None
-        self.file_path = file_path
+VectorReader = Callable[[Path], "gpd.GeoDataFrame"]
 
-    @property
-    def data(self) -> Union[gpd.GeoDataFrame, None]:
-        return self._data
+KML_NAMESPACE = "{http://www.opengis.net/kml/2.2}"
+KML_GEOMETRIES = ("Point", "LineString", "LinearRing", "Polygon",
+                  "MultiGeometry")
 
-    @data.setter
-    def data(self, value: gpd.GeoDataFrame):
-        self._data = value
 
-    @abstractmethod
-    def read(self) -> gpd.GeoDataFrame:
-        pass
+def _kml_coordinates(element) -> list:
+    """Parses the 'lon,lat[,alt] lon,lat[,alt] ...' text of an element."""
+    text = element.findtext(f"{KML_NAMESPACE}coordinates", default="")
+    return [tuple(float(value) for value in point.split(","))
+            for point in text.split()]
 
-    def to_file(self, file_path: str, driver: str = 'ESRI Shapefile') -> None:
-        if self.data is not None:
-            self.data.to_file(file_path, driver=driver)
-        else:
-            raise ValueError("No data to save. Please read a file first.")
 
+def _kml_geometry(element) -> "BaseGeometry":
+    """
+    Builds the shapely geometry of a KML geometry element.
 
-class GeoParquetHandler(GeoDataHandler):
-    def read(self) -> gpd.GeoDataFrame:
-        """Read GeoParquet file."""
-        self.data = gpd.read_parquet(self.file_path)
-        return self.data
+    Raises:
+        ValueError: if a Polygon has no outer boundary
+    """
+    from lxml import etree
+    from shapely.geometry import (Point, LineString, LinearRing, Polygon,
+                                  MultiPoint, MultiLineString, MultiPolygon,
+                                  GeometryCollection)
 
+    tag = etree.QName(element).localname
 
-class ShapefileHandler(GeoDataHandler):
-    def read(self) -> gpd.GeoDataFrame:
-        """Read ESRI Shapefile."""
-        self.data = gpd.read_file(self.file_path)
-        return self.data
+    if tag == "Point":
+        return Point(_kml_coordinates(element)[0])
+    if tag == "LineString":
+        return LineString(_kml_coordinates(element))
+    if tag == "LinearRing":
+        return LinearRing(_kml_coordinates(element))
+    if tag == "Polygon":
+        outer = element.find(
+            f"{KML_NAMESPACE}outerBoundaryIs/{KML_NAMESPACE}LinearRing")
+        if outer is None:
+            raise ValueError("Polygon without an outer boundary "
+                             f"(line {element.sourceline}).")
+        inners = element.findall(
+            f"{KML_NAMESPACE}innerBoundaryIs/{KML_NAMESPACE}LinearRing")
+        return Polygon(_kml_coordinates(outer),
+                       [_kml_coordinates(inner) for inner in inners])
 
+    # MultiGeometry
+    parts = [_kml_geometry(child) for child in element
+             if etree.QName(child).localname in KML_GEOMETRIES]
+    for single, multi in ((Point, MultiPoint),
+                          (LineString, MultiLineString),
+                          (Polygon, MultiPolygon)):
+        if parts and all(isinstance(part, single) for part in parts):
+            return multi(parts)
+    return GeometryCollection(parts)
 
-class GeoJSONHandler(GeoDataHandler):
-    def read(self) -> gpd.GeoDataFrame:
-        """Read GeoJSON file."""
-        self.data = gpd.read_file(self.file_path)
-        return self.data
 
+def _placemark_geometry(placemark) -> Optional["BaseGeometry"]:
+    from lxml import etree
 
-class KMLHandler(GeoDataHandler):
-    def read(self) -> gpd.GeoDataFrame:
-        """Read KML file."""
-        with open(self.file_path, 'r', encoding='utf-8') as kml_file:
-            doc = kml_file.read().encode('utf-8')
+    for child in placemark:
+        if etree.QName(child).localname in KML_GEOMETRIES:
+            return _kml_geometry(child)
+    return None
 
-        kml_data = kml.KML()
-        kml_data.from_string(doc)
 
-        features = list(kml_data.features())
-        placemarks = list(features[0].features())
+def read_geoparquet(file_path: Path) -> "gpd.GeoDataFrame":
+    """Read GeoParquet file."""
+    import geopandas as gpd
 
-        data = []
-        for placemark in placemarks:
-            data.append({
-                'name': placemark.name,
-                'geometry': shape(placemark.geometry)
-            })
+    return gpd.read_parquet(file_path)
 
-        self.data = gpd.GeoDataFrame(data)
-        return self.data
+
+def read_shapefile(file_path: Path) -> "gpd.GeoDataFrame":
+    """Read ESRI Shapefile."""
+    import geopandas as gpd
+
+    return gpd.read_file(file_path, engine='pyogrio', use_arrow=True)
+
+
+def read_geojson(file_path: Path) -> "gpd.GeoDataFrame":
+    """Read GeoJSON file."""
+    import geopandas as gpd
+
+    return gpd.read_file(file_path, engine='pyogrio', use_arrow=True)
+
+
+def read_kml(file_path: Path) -> "gpd.GeoDataFrame":
+    """
+    Read KML file.
+
+    Raises:
+        ValueError: if a placemark has an invalid geometry
+    """
+    import geopandas as gpd
+    from lxml import etree
+
+    names = []
+    geometries = []
+
+    # placemarks are parsed one at a time, and freed once read
+    for _, placemark in etree.iterparse(
+            str(file_path), tag=f"{KML_NAMESPACE}Placemark"):
+        names.append(placemark.findtext(f"{KML_NAMESPACE}name"))
+        try:
+            geometries.append(_placemark_geometry(placemark))
+        except ValueError as e:
+            raise ValueError(f"Invalid geometry in {file_path}: {e}") from e
+
+        placemark.clear()
+        while placemark.getprevious() is not None:
+            del placemark.getparent()[0]
+
+    # KML coordinates are always lon/lat in WGS84
+    return gpd.GeoDataFrame({'name': names},
+                            geometry=geometries,
+                            crs="EPSG:4326")
 
 
 class FileReader:
-    _handlers = {
-        '.parquet': GeoParquetHandler,
-        '.shp': ShapefileHandler,
-        '.geojson': GeoJSONHandler,
-        '.kml': KMLHandler
+    # reader function of each file extension
+    _readers: Dict[str, VectorReader] = {
+        '.parquet': read_geoparquet,
+        '.shp': read_shapefile,
+        '.geojson': read_geojson,
+        '.kml': read_kml
     }
 
     def __init__(self, filepath: Union[str, Path]):
-        self.file_path = Path(filepath)
+        self.file_path = (filepath if isinstance(filepath, Path)
+                          else Path(filepath))
+        # the reader is looked up by suffix on every read
+        self._suffix = self.file_path.suffix.casefold()
 
     @staticmethod
     def check_file_validity(filepath) -> Path:
-        if isinstance(filepath, (str, Path)):
+        if isinstance(filepath, str):
             filepath = Path(filepath)
-            if not filepath.exists():
-                raise FileNotFoundError(f"{filepath} does not exist.")
-        else:
+        elif not isinstance(filepath, Path):
             raise ValueError("Incorrect filepath type. Expected str or Path.")
+        if not filepath.exists():
+            raise FileNotFoundError(f"{filepath} does not exist.")
         return filepath
 
-    def _get_handler(self) -> GeoDataHandler:
-        """Get the appropriate handler based on file extension."""
-        extension = self.file_path.suffix.lower()
-        handler_class: Type[GeoDataHandler] = FileReader._handlers.get(extension)
-        if handler_class is None:
-            raise ValueError(f"Unsupported file extension: {extension}")
+    def _get_reader(self) -> VectorReader:
+        """Get the appropriate reader function based on file extension."""
+        reader = FileReader._readers.get(self._suffix)
+        if reader is None:
+            raise ValueError(f"Unsupported file extension: {self._suffix}")
 
-        return handler_class(self.file_path)
+        return reader
 
-    def read(self) -> gpd.GeoDataFrame:
-        """Read the file using the appropriate handler."""
+    def read(self) -> "gpd.GeoDataFrame":
+        """Read the file using the appropriate reader."""
         self.check_file_validity(self.file_path)
-        handler = self._get_handler()
-        gdf: gpd.GeoDataFrame = handler.read()
+        gdf: "gpd.GeoDataFrame" = self._get_reader()(self.file_path)
         logger.info(f"File {self.file_path} read successfully.")
         return gdf
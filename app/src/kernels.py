@@ -0,0 +1,143 @@
+"""
+Numba compiled kernels for the per pixel raster computations.
+
+numba is slow to import (and the kernels to compile), so this module is only
+imported by the functions that use it. The kernels are not cached on disk,
+as numba keys its cache on the module import name, and the module is imported
+both as src.kernels and as app.src.kernels.
+"""
+
+import math
+
+import numba
+import numpy as np
+
+
+@numba.njit(inline='always')
+def _border_gradient_magnitude(elevation, i, j, half_inv_cellsize):
+    """Gradient magnitude of a pixel, using one sided differences if needed."""
+    height, width = elevation.shape
+
+    left, right = max(j - 1, 0), min(j + 1, width - 1)
+    up, down = max(i - 1, 0), min(i + 1, height - 1)
+
+    # the differences are halved only when they span two cells
+    dzdx = (elevation[i, right] - elevation[i, left]) * (
+        half_inv_cellsize if right - left == 2 else 2 * half_inv_cellsize)
+    dzdy = (elevation[down, j] - elevation[up, j]) * (
+        half_inv_cellsize if down - up == 2 else 2 * half_inv_cellsize)
+
+    return math.sqrt(dzdx * dzdx + dzdy * dzdy)
+
+
+@numba.njit(parallel=True)
+def gradient_magnitude(elevation: np.ndarray, half_inv_cellsize,
+                       out: np.ndarray):
+    """
+    Writes into out the magnitude of the elevation gradient (rise over run)
+    of every pixel, in a single pass and without temporary arrays.
+
+    The gradients are those of np.gradient: central differences in the
+    interior and one sided differences at the borders. half_inv_cellsize is
+    0.5 / cellsize, of the data type of elevation.
+    """
+    height, width = elevation.shape
+
+    # interior pixels, without branches so that the loop is vectorized
+    for i in numba.prange(1, height - 1):
+        for j in range(1, width - 1):
+            dzdx = (elevation[i, j + 1] - elevation[i, j - 1]) * half_inv_cellsize
+            dzdy = (elevation[i + 1, j] - elevation[i - 1, j]) * half_inv_cellsize
+            out[i, j] = math.sqrt(dzdx * dzdx + dzdy * dzdy)
+
+    # first and last columns and rows
+    for i in range(height):
+        for j in (0, width - 1):
+            out[i, j] = _border_gradient_magnitude(elevation, i, j,
+                                                   half_inv_cellsize)
+    for j in range(width):
+        for i in (0, height - 1):
+            out[i, j] = _border_gradient_magnitude(elevation, i, j,
+                                                   half_inv_cellsize)
+
+
+# rounding functions supported by average_and_round, and their codes
+ROUNDING_CODES = {np.floor: 0, np.ceil: 1, np.round: 2, np.rint: 2}
+
+
+@numba.njit
+def average_and_round(stack: np.ndarray, rounding, nodata, out: np.ndarray):
+    """
+    Writes into out the average of the (band, y, x) stack of rasters, rounded
+    (floor, ceil or round half to even, by the ROUNDING_CODES code) where it
+    is not negative and nodata where it is, in a single pass. NaN averages
+    stay NaN.
+
+    The sum is accumulated in the data type of the stack, and divided by the
+    number of bands in it too, as the numpy mean of the stack does.
+
+    The kernel is serial, as it is called on the blocks of the stack from
+    several dask threads at once (see lookup_codes).
+    """
+    count, height, width = stack.shape
+    divisor = stack.dtype.type(count)
+
+    for i in range(height):
+        for j in range(width):
+            total = stack[0, i, j]
+            for k in range(1, count):
+                total += stack[k, i, j]
+            average = total / divisor
+
+            if average < 0:
+                out[i, j] = nodata
+            elif rounding == 0:
+                out[i, j] = np.floor(average)
+            elif rounding == 1:
+                out[i, j] = np.ceil(average)
+            else:
+                out[i, j] = np.rint(average)
+
+
+@numba.njit(parallel=True)
+def lookup_bins(values: np.ndarray, edges: np.ndarray, lut: np.ndarray,
+                out: np.ndarray):
+    """
+    Writes into out (flat arrays) the lut entry of the bin of every value:
+    the number of (sorted) edges the value is greater or equal to, or
+    len(edges) + 1 for NaN values.
+    """
+    nan_bin = edges.size + 1
+
+    for i in numba.prange(values.size):
+        value = values[i]
+        if value != value:
+            out[i] = lut[nan_bin]
+        else:
+            index = 0
+            for edge in edges:
+                index += value >= edge
+            out[i] = lut[index]
+
+
+@numba.njit
+def lookup_codes(values: np.ndarray, lut: np.ndarray, nodata,
+                 out: np.ndarray):
+    """
+    Writes into out (flat arrays) the lut entry of every (integer valued)
+    code, or nodata for nodata values, NaNs, codes out of the lut and non
+    integral values (which are not truncated to a code).
+
+    The kernel is serial, as it is called on the blocks of dask arrays from
+    several threads at once (parallel kernels cannot be launched
+    concurrently with the workqueue threading layer, which numba falls back
+    to without tbb or OpenMP).
+    """
+    for i in range(values.size):
+        value = values[i]
+        if value == nodata:
+            out[i] = nodata
+        elif value >= 0 and value < lut.size and value == math.floor(value):
+            out[i] = lut[numba.int64(value)]
+        else:
+            out[i] = nodata
@@ -2,13 +2,20 @@ import logging
 
 
 def setup_logging():
+    # skip collecting thread/process information that is never formatted
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
     logger = logging.getLogger('land_classifier')
     logger.setLevel(logging.INFO)
 
     if not logger.handlers:
         console_handler = logging.StreamHandler()
         console_handler.setLevel(logging.INFO)
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        formatter = logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+            datefmt='%H:%M:%S')
         console_handler.setFormatter(formatter)
         logger.addHandler(console_handler)
 
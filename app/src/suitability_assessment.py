@@ -1,14 +1,21 @@
+import logging
+import os
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Union, Optional, List, Dict, Callable, Tuple
 from pathlib import Path
 from enum import Enum
-from dataclasses import dataclass, field
+from dataclasses import dataclass
+import dask.array as da
 import geopandas as gpd
 import numpy as np
 import numpy.typing as npt
 import rasterio as rio
 from rasterio.crs import CRS
-from shapely.geometry import box
+from rasterio.features import geometry_mask
+from rasterio.windows import get_data_window
+import rioxarray  # noqa: F401 (registers the .rio accessor)
+from rioxarray.exceptions import NoDataInBounds
 import xarray as xr
 
 from .tools import add_word_to_filename
@@ -20,6 +27,11 @@ from .logging_config import logger
 ArrayFunction = Callable[[npt.ArrayLike], npt.ArrayLike]
 
 
+# widest range of categories counted with np.bincount (more widely spread
+# categories are counted one by one)
+MAX_BINCOUNT_CATEGORIES = 65536
+
+
 class Suitability(Enum):
     Low = 1
     Medium = 2
@@ -50,31 +62,32 @@ class CoverTypeConfig:
     high_suitability_covers: List[Union[int, str]]
 
 
-@dataclass
+# slotted, since the stats are updated by every analysis step
+@dataclass(slots=True)
 class Stats:
-    project_name: Optional[str] = field(default=None)
-    years: Optional[List[int]] = field(default=None)
-    project_crs: Optional[int] = field(default=None)
-    project_bbox: Optional[Dict[str, float]] = field(default=None)
-    aoi_area: Optional[Tuple[float, str]] = field(default=None)
-    aoi_within_admin_border_area: Optional[Tuple[float, str]] = field(default=None)
-    aoi_outside_admin_border_area: Optional[Tuple[float, str]] = field(default=None)
-    intersect_with_protected_area: Optional[Tuple[float, str]] = field(default=None)
-    area_non_protected: Optional[Tuple[float, str]] = field(default=None)  # Ha
+    project_name: Optional[str] = None
+    years: Optional[List[int]] = None
+    project_crs: Optional[int] = None
+    project_bbox: Optional[Dict[str, float]] = None
+    aoi_area: Optional[Tuple[float, str]] = None
+    aoi_within_admin_border_area: Optional[Tuple[float, str]] = None
+    aoi_outside_admin_border_area: Optional[Tuple[float, str]] = None
+    intersect_with_protected_area: Optional[Tuple[float, str]] = None
+    area_non_protected: Optional[Tuple[float, str]] = None  # Ha
     # slope
-    average_slope: Optional[Tuple[float, str]] = field(default=None)  # %
-    max_slope: Optional[Tuple[float, str]] = field(default=None)  # %
-    min_slope: Optional[Tuple[float, str]] = field(default=None)  # %
+    average_slope: Optional[Tuple[float, str]] = None  # %
+    max_slope: Optional[Tuple[float, str]] = None  # %
+    min_slope: Optional[Tuple[float, str]] = None  # %
     # land cover
-    area_of_adequate_land_cover_over_time: Optional[Tuple[float, str]] = field(default=None)  # %
+    area_of_adequate_land_cover_over_time: Optional[Tuple[float, str]] = None  # %
     # hand
-    average_height_above_drainage: Optional[Tuple[float, str]] = field(default=None)
-    max_height_above_drainage: Optional[Tuple[float, str]] = field(default=None)
-    min_height_above_drainage: Optional[Tuple[float, str]] = field(default=None)
+    average_height_above_drainage: Optional[Tuple[float, str]] = None
+    max_height_above_drainage: Optional[Tuple[float, str]] = None
+    min_height_above_drainage: Optional[Tuple[float, str]] = None
     # suitabilities
-    area_low_suitability: Optional[Tuple[float, str]] = field(default=None)
-    area_medium_suitability: Optional[Tuple[float, str]] = field(default=None)
-    area_high_suitability: Optional[Tuple[float, str]] = field(default=None)
+    area_low_suitability: Optional[Tuple[float, str]] = None
+    area_medium_suitability: Optional[Tuple[float, str]] = None
+    area_high_suitability: Optional[Tuple[float, str]] = None
 
 
 class Project(object):
@@ -146,6 +159,12 @@ class Project(object):
         reader = FileReader(aoi_path)
         aoi: gpd.GeoDataFrame = reader.read()
         self.aoi = aoi.to_crs(self.crs)
+        # bounds of the aoi in the CRS of the input rasters
+        self._aoi_bounds_by_crs = {}
+        # sub-region borders and protected areas, read and reprojected once
+        # per CRS
+        self._sub_region_by_crs = {}
+        self._protected_areas_by_crs = {}
 
         # get site bounding box in WGS84, which is the generally default for pystac
         self.aoi_bbox_WGS84 = aoi.to_crs("EPSG:4326").total_bounds
@@ -177,6 +196,42 @@ class Project(object):
         # analysis
         self.rasters_to_analyze = []
 
+    @property
+    def available_land(self) -> Optional[gpd.GeoDataFrame]:
+        return self._available_land
+
+    @available_land.setter
+    def available_land(self, value: Optional[gpd.GeoDataFrame]):
+        self._available_land = value
+        # the union and bounds of the previous available land are no longer
+        # valid
+        self._available_land_union = None
+        self._available_land_bounds_by_crs = {}
+        self._available_land_masks = {}
+
+    @property
+    def available_land_union(self):
+        """
+        Union of all the available land geometries, used to clip the
+        rasters. It is only computed once for every available land value.
+        """
+        if self._available_land_union is None:
+            self._available_land_union = \
+                self.available_land.geometry.union_all()
+        return self._available_land_union
+
+    def _available_land_bounds(self, crs: CRS) -> Dict[str, float]:
+        """
+        Bounds of the available land in the given CRS. They are computed
+        once per CRS, since most rasters share the same one.
+        """
+        crs_key = str(crs)
+        bounds = self._available_land_bounds_by_crs.get(crs_key)
+        if bounds is None:
+            bounds = self.available_land.to_crs(crs).bounds.iloc[0, :].to_dict()
+            self._available_land_bounds_by_crs[crs_key] = bounds
+        return bounds
+
     @staticmethod
     def handler_decorator(method_name):
         def decorator(func):
@@ -237,12 +292,13 @@ class Project(object):
 
         if (not slope_config) and (not cover_config) and (not hand_config):
             if self.rasters_to_analyze:
-                str_ = '\n\t'.join(self.rasters_to_analyze)
-                logger.info("Since no configurations were passed, "
-                            "skip data collection and processing. The "
-                            " followiing rasters will be analyzed: \n\t "
-                            f"{str_}"
-                            )
+                if logger.isEnabledFor(logging.INFO):
+                    str_ = '\n\t'.join(self.rasters_to_analyze)
+                    logger.info("Since no configurations were passed, "
+                                "skip data collection and processing. The "
+                                " followiing rasters will be analyzed: \n\t "
+                                f"{str_}"
+                                )
                 if not self.available_land:
                     if land_checks:
                         self.check_aoi_location()
@@ -309,68 +365,100 @@ class Project(object):
             self.available_land = self.aoi
 
         if self.rasters_to_analyze:
-            str_ = '\t\n'.join(map(str, self.rasters_to_analyze))
-            logger.info("Performing map algebra on "
-                        f"{str_}.")
+            if logger.isEnabledFor(logging.INFO):
+                str_ = '\t\n'.join(map(str, self.rasters_to_analyze))
+                logger.info("Performing map algebra on "
+                            f"{str_}.")
         else:
             logger.error("No rasters to analyze.")
             sys.exit()
 
-        sum_raster = None
-        for raster_path in self.rasters_to_analyze:
-            xds = self.io_handler.read_raster(raster_path)
-            if sum_raster is None:
-                sum_raster = xds
-            else:
-                sum_raster += xds
-
-        avg_raster = sum_raster / len(self.rasters_to_analyze)
-
-        negative_mask = avg_raster < 0
-        # redefine de nodata value
-        avg_raster = avg_raster.where(~negative_mask, other=-9999)
-
-        result_raster = xr.apply_ufunc(rounding_mechanism,
-                                       avg_raster)
+        # the rasters share the grid (and so the chunks) of the processed
+        # reference raster, so their chunks are read in parallel, in float32
+        rasters = [self.io_handler.read_raster(raster_path)
+                   for raster_path in self.rasters_to_analyze]
+        first_xds = rasters[0]
+        stack = da.stack([xds.data for xds in rasters], axis=0).astype(
+            np.float32).rechunk({0: -1})
+
+        # average, round, and redefine de nodata value (negative averages)
+        # lazily, block by block, so only the blocks of the stack being
+        # averaged are held in memory
+        result_array = stack.map_blocks(
+            Project._average_and_round, rounding_mechanism, nodata=-9999,
+            drop_axis=0, dtype=np.float32)
+        result_raster = xr.DataArray(
+            result_array,
+            coords=first_xds.coords,
+            dims=first_xds.dims,
+            attrs=first_xds.attrs)
 
         self.io_handler.write_vector(
             self.io_handler.remaining_land_projected_path,
             self.available_land)
 
         # clip the resulting raster using the aoi
-        clipped_raster = result_raster.rio.clip(
-            [self.available_land.geometry.union_all()],
-            crs=self.available_land.crs,
-            drop=True)
+        clipped_raster = self._clip_to_available_land(result_raster)
 
         metadata = {
                 'driver': 'GTiff',
                 'dtype': 'int32',
                 'count': 1,
-                'width': xds.sizes['x'],
-                'height': xds.sizes['y'],
-                'crs': xds.rio.crs,
-                'transform': xds.rio.transform
+                'width': first_xds.sizes['x'],
+                'height': first_xds.sizes['y'],
+                'crs': first_xds.rio.crs,
+                'transform': first_xds.rio.transform
         }
 
-        # save the final result raster
+        # save the final result raster, computed tile by tile as it is
+        # written
         logger.info("Final result stored in: "
                     f"{self.io_handler.analysis_output_path}")
         self.io_handler.write_raster(self.io_handler.analysis_output_path,
                                      clipped_raster, nodata=-9999,
-                                     metadata=metadata)
-
-        area_low = Project.calculate_area_of_category(clipped_raster,
-                                                      Suitability.Low.code) / 1e4
-        area_medium = Project.calculate_area_of_category(clipped_raster,
-                                                         Suitability.Medium.code) / 1e4
-        area_high = Project.calculate_area_of_category(clipped_raster,
-                                                       Suitability.High.code) / 1e4
+                                     metadata=metadata, overviews=True,
+                                     windowed=True)
+
+        # the areas are counted on the written raster, instead of computing
+        # the result again
+        area_low, area_medium, area_high = \
+            Project.calculate_area_of_categories(
+                self.io_handler.read_raster(
+                    self.io_handler.analysis_output_path),
+                [Suitability.Low.code,
+                 Suitability.Medium.code,
+                 Suitability.High.code]) / 1e4
 
         self.stats.area_low_suitability = (area_low, "Ha")
         self.stats.area_medium_suitability = (area_medium, "Ha")
         self.stats.area_high_suitability = (area_high, "Ha")
 
+    @staticmethod
+    def _average_and_round(stack: np.ndarray,
+                           rounding_mechanism: ArrayFunction,
+                           nodata: float) -> np.ndarray:
+
+        """
+        Averages the (band, y, x) stack of rasters (or a block of it) and
+        rounds the result with rounding_mechanism, setting nodata where the
+        average is negative.
+
+        np.floor, np.ceil and np.round are applied with a compiled kernel, in
+        a single pass over the stack. Any other function is applied with
+        numpy.
+        """
+        from .kernels import ROUNDING_CODES, average_and_round
+
+        rounding = ROUNDING_CODES.get(rounding_mechanism)
+        if rounding is None:
+            avg_array = stack.mean(axis=0)
+            return np.where(avg_array < 0, nodata,
+                            rounding_mechanism(avg_array))
+
+        result = np.empty(stack.shape[1:], dtype=stack.dtype)
+        average_and_round(stack, rounding, nodata, result)
+        return result
+
     @handler_decorator('ensure_addresses_exist')
     def get_data(self, dem=True, land_cover=True, hand=True, years=None):
 
@@ -378,15 +466,22 @@ class Project(object):
 
         available_msg = "File {file} already available. Skipping download."
 
+        # the datasets are independent, so the missing ones are collected
+        # here (as download function and arguments) and downloaded together
+        downloads = []
+
         # check if administrative borders available or download
         if not self.io_handler.address_exists(self.io_handler.region_border_path):
-            data_downloader.get_border(self.country_code,
-                                       self.io_handler.region_border_path)
+            downloads.append((data_downloader.get_border,
+                              (self.country_code,
+                               self.io_handler.region_border_path)))
         else:
             logger.info(
                 available_msg.format(file=self.io_handler.region_border_path))
 
-        # check if protected areas available or download
+        # check if protected areas available or download. The download is
+        # not implemented yet (it raises), so it runs before any other
+        # download is submitted, to fail fast
         if not self.io_handler.address_exists(
              self.io_handler.protected_areas_path):
             data_downloader.get_protected_areas(
@@ -400,57 +495,69 @@ class Project(object):
             # check if DEM is available, and if it covers the aoi, else download
             if not self.io_handler.address_exists(self.io_handler.dem_file_path
                                                   ) or \
-               not Project.is_polygon_within_raster_extent(
-                   self.aoi,
-                   self.io_handler.read_raster(self.io_handler.dem_file_path)):
-                data_downloader.get_dem_planetary_computer(
-                    self.aoi_bbox_WGS84, self.io_handler.dem_file_path)
+               not self._aoi_within_raster_extent(
+                   self.io_handler.dem_file_path):
+                downloads.append((data_downloader.get_dem_planetary_computer,
+                                  (self.aoi_bbox_WGS84,
+                                   self.io_handler.dem_file_path)))
             else:
                 logger.info(
                     available_msg.format(file=self.io_handler.dem_file_path))
 
         if land_cover:
             # Determine which years have missing land cover data
+            existing_paths = self.io_handler.list_existing_paths(
+                self.io_handler.land_cover_paths.values())
             missing_years = {
                 year: path
                 for year, path in self.io_handler.land_cover_paths.items()
-                if not self.io_handler.address_exists(path)
+                if path not in existing_paths
             }
 
             for year, path in self.io_handler.land_cover_paths.items():
-                if year in missing_years:
-                    # for missing data, download it
-                    data_downloader.get_land_cover_data(self.aoi_bbox_WGS84,
-                                                        year, path)
-                else:
+                if year not in missing_years:
                     # for existing data, check its validity
-                    xds = self.io_handler.read_raster(path)
-                    if Project.is_polygon_within_raster_extent(self.aoi, xds):
+                    if self._aoi_within_raster_extent(path):
                         logger.info(available_msg.format(file=path))
                     else:
                         # if the existing data is not valid, download it
-                        data_downloader.get_land_cover_data(
-                            self.aoi_bbox_WGS84, year, path)
+                        missing_years[year] = path
 
-            # update the available data files and paths and continue with them
-            self.io_handler.land_cover_paths = {
-                year: path
-                for year, path in self.io_handler.land_cover_paths.items()
-                if self.io_handler.address_exists(path)}
+            # download all the missing years at once
+            if missing_years:
+                downloads.append((data_downloader.get_land_cover_data_multi,
+                                  (self.aoi_bbox_WGS84, missing_years)))
 
         if hand:
             if not self.io_handler.address_exists(self.io_handler.hand_file_path) or \
-                not Project.is_polygon_within_raster_extent(
-                   self.aoi,
-                   self.io_handler.read_raster(self.io_handler.hand_file_path)
-                   ):
+                not self._aoi_within_raster_extent(
+                    self.io_handler.hand_file_path):
 
-                data_downloader.get_hand_data(self.aoi_bbox_WGS84,
-                                              self.io_handler.hand_file_path)
+                downloads.append((data_downloader.get_hand_data,
+                                  (self.aoi_bbox_WGS84,
+                                   self.io_handler.hand_file_path)))
             else:
                 logger.info(available_msg.format(
                     file=self.io_handler.hand_file_path))
 
+        # the downloads are network bound, so they run in threads
+        if downloads:
+            with ThreadPoolExecutor(max_workers=len(downloads)) as executor:
+                futures = [executor.submit(function, *args)
+                           for function, args in downloads]
+                # re-raise any error that occurred during the downloads
+                for future in as_completed(futures):
+                    future.result()
+
+        if land_cover:
+            # update the available data files and paths and continue with them
+            existing_paths = self.io_handler.list_existing_paths(
+                self.io_handler.land_cover_paths.values())
+            self.io_handler.land_cover_paths = {
+                year: path
+                for year, path in self.io_handler.land_cover_paths.items()
+                if path in existing_paths}
+
         logger.info("Finished downloading all required datasets.")
 
     @handler_decorator('ensure_addresses_exist')
@@ -495,8 +602,7 @@ class Project(object):
 
         # clip the reference raster around the available land, but with the
         # ref_xds EPSG
-        temp_available_land_crs1 = self.available_land.to_crs(ref_xds.rio.crs)
-        bbox1 = temp_available_land_crs1.bounds.iloc[0, :].to_dict()
+        bbox1 = self._available_land_bounds(ref_xds.rio.crs)
         ref_xdsc = ref_xds.rio.clip_box(**bbox1)
 
         # reproject ref dataset to the project EPSG
@@ -505,25 +611,57 @@ class Project(object):
 
         logger.info(f"All rasters will be reprojected to {self.crs.data['init']}")
 
-        for file in available_rasters:
-            result_path = add_word_to_filename(
-                self.io_handler.intermediate_results_dir.joinpath(file.name))
+        # the reference raster is written first, and the rest are clipped,
+        # reprojected and written concurrently (GDAL releases the GIL)
+        if reference_raster in available_rasters:
+            self._write_processed_raster(reference_raster, ref_xdsc_proj)
 
-            if result_path.is_file():
-                logger.warning(f"Overriding {result_path}.")
+        other_rasters = [file for file in available_rasters
+                         if file != reference_raster]
+        if other_rasters:
+            with ThreadPoolExecutor(
+                    max_workers=min(len(other_rasters),
+                                    os.cpu_count() or 1)) as executor:
+                list(executor.map(
+                    lambda file: self._process_one_raster(file,
+                                                          ref_xdsc_proj),
+                    other_rasters))
 
-            if file == reference_raster:
-                self.io_handler.write_raster(result_path, ref_xdsc_proj)
-            else:
-                xds = self.io_handler.read_raster(file)
-                # get available land to CRS of xds
-                temp_available_land_crs2 = self.available_land.to_crs(
-                    xds.rio.crs)
-                # cut xds with available land at xds CRS
-                bbox2 = temp_available_land_crs2.bounds.iloc[0, :].to_dict()
-                xdsc = xds.rio.clip_box(**bbox2)
-                xdsc_proj = xdsc.rio.reproject_match(ref_xdsc_proj)
-                self.io_handler.write_raster(result_path, xdsc_proj)
+    def _process_one_raster(self, file: Path, ref_xdsc_proj: xr.DataArray):
+
+        """
+        Clips the raster around the available land, reprojects it to match
+        the (processed) reference raster, and writes the result.
+        """
+
+        xds = self.io_handler.read_raster(file)
+        # cut xds with available land at xds CRS
+        bbox2 = self._available_land_bounds(xds.rio.crs)
+        xdsc = xds.rio.clip_box(**bbox2)
+
+        if Project._same_grid(xdsc, ref_xdsc_proj):
+            # already on the reference grid, no need to warp it
+            self._write_processed_raster(file, xdsc)
+        else:
+            xdsc_proj = xdsc.rio.reproject_match(ref_xdsc_proj)
+            self._write_processed_raster(file, xdsc_proj)
+
+    @staticmethod
+    def _same_grid(xds: xr.DataArray, other: xr.DataArray) -> bool:
+        """Whether both rasters have the same CRS, transform and shape."""
+        return (xds.shape[-2:] == other.shape[-2:] and
+                xds.rio.crs == other.rio.crs and
+                xds.rio.transform().almost_equals(other.rio.transform()))
+
+    def _write_processed_raster(self, file: Path, xds: xr.DataArray):
+
+        result_path = add_word_to_filename(
+            self.io_handler.intermediate_results_dir.joinpath(file.name))
+
+        if result_path.is_file():
+            logger.warning(f"Overriding {result_path}.")
+
+        self.io_handler.write_raster(result_path, xds)
 
     @handler_decorator('ensure_addresses_exist')
     def slope_analysis(self, slope_config: Optional[SlopeConfig] = None):
@@ -548,10 +686,10 @@ class Project(object):
         meta_slopes.update(dtype=rio.float32)
 
         meta_slopes_classified = xds.attrs.copy()
-        meta_slopes_classified['dtype'] = 'uint32'
+        meta_slopes_classified['dtype'] = 'uint8'
 
-        classified_slopes: np.array = self._reclassify(slope_data,
-                                                       slope_config)
+        classified_slopes: np.array = Project._reclassify(slope_data,
+                                                          slope_config)
 
         # Save intermediate result to file
         slope_data_xr = xr.DataArray(slope_data,
@@ -580,15 +718,12 @@ class Project(object):
 
         self.rasters_to_analyze.append(self.io_handler.reclassified_slope_path)
 
-        # update stats
-        slope_data_xr_clipped = slope_data_xr.rio.clip(
-            [self.available_land.geometry.union_all()],
-            crs=self.available_land.crs)
-
-        self.stats.average_slope = (float(np.nanmean(slope_data_xr_clipped)),
-                                    "%")
-        self.stats.max_slope = (float(np.nanmax(slope_data_xr_clipped)), "%")
-        self.stats.min_slope = (float(np.nanmin(slope_data_xr_clipped)), "%")
+        # update stats, with the slopes within the available land
+        mean_slope, min_slope, max_slope = Project.calculate_nan_stats(
+            slope_data, self._available_land_mask(xds))
+        self.stats.average_slope = (mean_slope, "%")
+        self.stats.max_slope = (max_slope, "%")
+        self.stats.min_slope = (min_slope, "%")
 
     @handler_decorator('ensure_addresses_exist')
     def land_cover_analysis(self, cover_config: CoverTypeConfig):
@@ -610,25 +745,22 @@ class Project(object):
         xds = self.io_handler.read_raster(
             self.io_handler.hand_file_path_projected)
 
-        hand_data = xds.data
+        hand_data = xds.values
 
-        xds_clipped = xds.rio.clip([self.available_land.geometry.union_all()],
-                                   crs=self.available_land.crs,
-                                   drop=True)
-        self.stats.average_height_above_drainage = (
-            float(np.nanmean(xds_clipped)), "m")
-        self.stats.min_height_above_drainage = (float(np.nanmin(xds_clipped)),
-                                                "m")
-        self.stats.max_height_above_drainage = (float(np.nanmax(xds_clipped)),
-                                                "m")
+        # update stats, with the HAND within the available land
+        mean_hand, min_hand, max_hand = Project.calculate_nan_stats(
+            hand_data, self._available_land_mask(xds))
+        self.stats.average_height_above_drainage = (mean_hand, "m")
+        self.stats.min_height_above_drainage = (min_hand, "m")
+        self.stats.max_height_above_drainage = (max_hand, "m")
 
         meta = xds.attrs.copy()
 
         # ensure the data type uint
-        meta['dtype'] = 'uint32'
+        meta['dtype'] = 'uint8'
 
-        classified_hand: np.array = self._reclassify(hand_data,
-                                                     hand_config)
+        classified_hand: np.array = Project._reclassify(hand_data,
+                                                        hand_config)
 
         classified_hand_xr = xr.DataArray(classified_hand,
                                           dims=xds.dims,
@@ -690,76 +822,87 @@ class Project(object):
             config.high_suitability_covers
         )
 
+        # pixels with a viable land cover in every year. The masks of all
+        # years are reduced lazily, chunk by chunk, so the years are read in
+        # parallel and never held in memory at once
         combined_mask = None
 
         last_year = max(file_paths.keys())
 
         for year, fname in file_paths.items():
 
-            xds = self.io_handler.read_raster(fname)
+            # read the land cover with its native (integer) data type
+            xds, valid_mask = self.io_handler.read_raster(
+                fname, preserve_dtype=True)
 
-            # Mask No Data and Clouds
-            xds = xds.where(
-                (xds != no_data_class) &
-                (xds != clouds_class),
-                np.nan)
+            # Mask No Data and Clouds, and keep the viable categories
+            mask = (da.isin(xds.data, viable_categories) & valid_mask.data &
+                    (xds.data != no_data_class) & (xds.data != clouds_class))
 
-            if year == last_year:
-                last_data_array = xds
+            combined_mask = (mask if combined_mask is None
+                             else combined_mask & mask)
 
-            data = xds.values
-
-            # Create a mask for viable categories
-            mask = np.isin(data, viable_categories)
+            if year == last_year:
+                last_xds = xds
 
-            if combined_mask is None:
-                combined_mask = mask
-            else:
-                combined_mask = np.logical_and(combined_mask, mask)
+        # the last year is only read once, for both results
+        combined_mask, last_data = da.compute(combined_mask, last_xds.data)
 
-        # extract metadata and ensure the data type is float32
-        meta = last_data_array.attrs
+        # extract metadata and ensure the data type is int32
+        meta = last_xds.attrs.copy()
+        meta.pop('_FillValue', None)
         meta['dtype'] = 'int32'
 
-        # set values of last year to the combined mask, else np.nan
-        result: np.array = np.where(combined_mask, last_data_array.data, np.nan)
+        # set values of last year to the combined mask, else -9999 (nodata
+        # and clouds of the last year are never in the combined mask). The
+        # codes stay integers, so no float copy is needed
+        result: np.array = np.full(last_data.shape, -9999, dtype=np.int32)
+        np.copyto(result, last_data, where=combined_mask)
 
         # Save intermediate result to file
         result_raster = xr.DataArray(result,
-                                     coords=last_data_array.coords,
-                                     dims=last_data_array.dims,
+                                     coords=last_xds.coords,
+                                     dims=last_xds.dims,
                                      attrs=meta)
 
-        # update stats
-        raster_cut = result_raster.rio.clip(
-            [self.available_land.geometry.union_all()],
-            crs=self.available_land.crs,
-            drop=True)
+        # update stats: the viable pixels are those of the combined mask, so
+        # they are counted within the available land mask of the grid,
+        # without clipping the raster
+        available_mask = self._available_land_mask(result_raster)
+        if not available_mask.any():
+            raise NoDataInBounds("No data found in bounds.")
 
-        viable_area = Project.calculate_area_of_category(raster_cut,
-                                                         viable_categories)
+        pixel_size_x, pixel_size_y = result_raster.rio.resolution()
+        viable_area = (np.count_nonzero(combined_mask & available_mask) *
+                       abs(pixel_size_x * pixel_size_y))
         self.stats.area_of_adequate_land_cover_over_time = (viable_area / 1e4,
                                                             "Ha")
 
-        result_raster.rio.write_crs(last_data_array.rio.crs, inplace=True)
+        # the nodata value is written with the raster, so that it is masked
+        # on read as the NaNs were
+        result_raster.rio.write_crs(last_xds.rio.crs, inplace=True)
+        result_raster.rio.write_nodata(-9999, inplace=True)
         self.io_handler.write_raster(self.io_handler.result_land_cover_path,
-                                     result_raster)
+                                     result_raster, nodata=-9999)
 
-        # reclassify land cover
-        classified_land_cover: np.array = \
-            self._reclassify_land_cover(result, config)
+        # reclassify land cover lazily, block by block, as the blocks are
+        # written, so the classified raster is never held in memory at once
+        classified_land_cover = da.from_array(
+            result, chunks=last_xds.data.chunks).map_blocks(
+                Project._reclassify_land_cover, config, dtype=np.int32)
 
         classified_data_array = xr.DataArray(classified_land_cover,
-                                             coords=last_data_array.coords,
-                                             dims=last_data_array.dims,
+                                             coords=last_xds.coords,
+                                             dims=last_xds.dims,
                                              attrs=meta
                                              )
 
         # Save the classified land cover
-        classified_data_array.rio.write_crs(last_data_array.rio.crs,
+        classified_data_array.rio.write_crs(last_xds.rio.crs,
                                             inplace=True)
         self.io_handler.write_raster(classified_land_cover_path,
-                                     classified_data_array, nodata=-9999)
+                                     classified_data_array, nodata=-9999,
+                                     windowed=True)
 
     @staticmethod
     def calculate_slope(elevation: np.ndarray, cellsize: float) -> np.ndarray:
@@ -769,13 +912,22 @@ class Project(object):
         :param cellsize: Size of a cell (assumed square)
         :return: 2D numpy array of slope values
         """
-        # Calculate gradient
-        dzdx = np.gradient(elevation, axis=1) / cellsize
-        dzdy = np.gradient(elevation, axis=0) / cellsize
+        from .kernels import gradient_magnitude
 
-        # Calculate slope in degrees
-        slope = np.sqrt(dzdx**2 + dzdy**2)
-        slope = np.arctan(slope) * (180 / np.pi)
+        if min(elevation.shape) < 2:
+            raise ValueError("The elevation data needs at least 2 rows and "
+                             "2 columns to calculate the slope.")
+
+        # float rasters keep their precision, anything else becomes float64
+        dtype = (elevation.dtype if np.issubdtype(elevation.dtype, np.floating)
+                 else np.dtype(np.float64))
+
+        # compute the gradient magnitude in a single compiled pass, and turn
+        # it into degrees in place
+        slope = np.empty(elevation.shape, dtype=dtype)
+        gradient_magnitude(np.ascontiguousarray(elevation, dtype=dtype),
+                           dtype.type(0.5 / cellsize), slope)
+        np.degrees(np.arctan(slope, out=slope), out=slope)
 
         return slope
 
@@ -801,9 +953,9 @@ class Project(object):
         protected_areas = self._load_protected_areas_polygons(self.aoi.crs)
 
         # Calculate the intersection with protected areas in WGS84
-        aoi_border_prot_inters = gpd.overlay(aoi_border_overlay,
-                                             protected_areas,
-                                             how='intersection')
+        aoi_border_prot_inters = Project._overlay(aoi_border_overlay,
+                                                  protected_areas,
+                                                  how='intersection')
 
         # calculate areas in Ha
         aoi_original_area = self.aoi.geometry[0].area / 1e4
@@ -847,9 +999,9 @@ class Project(object):
 
             # calculate the difference with protected areas, which will
             # be the remaining land
-            remaining_land = gpd.overlay(aoi_border_overlay,
-                                         protected_areas,
-                                         how='difference')
+            remaining_land = Project._overlay(aoi_border_overlay,
+                                              protected_areas,
+                                              how='difference')
 
         else:
             logger.info("No intersection found with protected areas.")
@@ -869,44 +1021,173 @@ class Project(object):
 
         self.available_land = remaining_land
 
-    def _reclassify(self, original_array: np.array,
+    def _available_land_mask(self, xds: xr.DataArray) -> np.ndarray:
+
+        """
+        Rasterizes the available land on the grid of xds. The mask is True
+        for the pixels that rio.clip would keep. It is only rasterized once
+        for every grid (all the processed rasters share the same one).
+        """
+
+        transform = xds.rio.transform(recalc=True)
+        key = (transform, xds.rio.crs.to_wkt(), xds.shape[-2:])
+        mask = self._available_land_masks.get(key)
+        if mask is not None:
+            return mask
+
+        geometry = self.available_land_union
+        if self.available_land.crs != xds.rio.crs:
+            geometry = gpd.GeoSeries(
+                [geometry], crs=self.available_land.crs
+                ).to_crs(xds.rio.crs).iloc[0]
+
+        mask = geometry_mask([geometry],
+                             out_shape=xds.shape[-2:],
+                             transform=transform,
+                             invert=True)
+        self._available_land_masks[key] = mask
+        return mask
+
+    def _clip_to_available_land(self, xds: xr.DataArray) -> xr.DataArray:
+
+        """
+        Equivalent to clipping xds with the available land (rio.clip with
+        drop=True), but using the cached mask of its grid: the raster is
+        cropped to the extent of the mask, and the pixels outside of it are
+        set to NaN.
+        """
+
+        mask = self._available_land_mask(xds)
+        if not mask.any():
+            raise NoDataInBounds("No data found in bounds.")
+
+        window = get_data_window(np.ma.masked_array(mask, ~mask))
+        cropped = xds.rio.isel_window(window)
+        cropped_mask = xr.DataArray(mask[window.toslices()],
+                                    dims=cropped.dims[-2:])
+
+        return cropped.where(cropped_mask)
+
+    @staticmethod
+    def _reclassify(original_array: np.array,
                     config: Union[SlopeConfig, HANDConfig]):
 
-        # create an empty array for the results
-        reclassified_array = np.empty_like(original_array, dtype="uint32")
+        # thresholds are compared in the precision of the data
+        dtype = (original_array.dtype
+                 if np.issubdtype(original_array.dtype, np.floating)
+                 else np.dtype(np.float64))
+        low, medium, high = (dtype.type(threshold) for threshold in (
+            config.low_threshold, config.medium_threshold,
+            config.high_threshold))
+
+        # the suitability can only change at these values (x > medium being
+        # x >= the next representable value), so it is constant between them
+        edges = np.unique(np.array(
+            [low, high, np.nextafter(medium, dtype.type(np.inf))],
+            dtype=dtype))
+
+        # classify one value of each interval (and NaN, which gets a bin of
+        # its own after the last edge) to build a lookup table from bin
+        # index to suitability code
+        samples = np.concatenate(
+            [[np.nextafter(edges[0], dtype.type(-np.inf))], edges, [np.nan]]
+            ).astype(dtype)
+        lut = Project._classify_by_thresholds(samples, config)
+
+        # look up the bin of every value (the number of edges it is greater
+        # or equal to) in a single compiled pass
+        from .kernels import lookup_bins
+
+        values = np.ascontiguousarray(original_array)
+        reclassified_array = np.empty(values.shape, dtype=lut.dtype)
+        lookup_bins(values.reshape(-1), edges, lut,
+                    reclassified_array.reshape(-1))
+
+        return reclassified_array
+
+    @staticmethod
+    def _classify_by_thresholds(original_array: np.array,
+                                config: Union[SlopeConfig, HANDConfig]):
 
         # define conditions based on the configuration
         condition_low = (original_array < config.low_threshold) | (original_array > config.medium_threshold)
         condition_high = (original_array >= config.low_threshold) & (original_array < config.high_threshold)
-        condition_medium = ~condition_low & ~condition_high
 
-        # assign the suitability based on conditions
-        reclassified_array[condition_low] = Suitability.Low.code
-        reclassified_array[condition_high] = Suitability.High.code
-        reclassified_array[condition_medium] = Suitability.Medium.code
-
-        return reclassified_array
+        # assign the suitability based on conditions (the first that holds:
+        # high takes precedence over low), medium being the rest
+        return np.select([condition_high, condition_low],
+                         [np.uint8(Suitability.High.code),
+                          np.uint8(Suitability.Low.code)],
+                         np.uint8(Suitability.Medium.code))
 
-    def _reclassify_land_cover(self, original_array: np.array,
+    @staticmethod
+    def _reclassify_land_cover(original_array: np.array,
                                config: CoverTypeConfig):
 
-        # Create an empty array for the results
-        reclassified_array = np.empty_like(original_array, dtype="int32")
-        condition_nans = np.isnan(original_array)
-        condition_low = np.isin(original_array,
-                                config.low_suitability_covers)
-        condition_medium = np.isin(original_array,
-                                   config.medium_suitability_covers)
-        condition_high = np.isin(original_array,
-                                 config.high_suitability_covers)
-
-        reclassified_array[condition_nans] = -9999
-        reclassified_array[condition_low] = Suitability.Low.code
-        reclassified_array[condition_high] = Suitability.High.code
-        reclassified_array[condition_medium] = Suitability.Medium.code
+        """
+        Reclassifies the land cover codes (NaN or -9999 where there is no
+        data) into suitabilities, with a lookup table indexed by the codes,
+        in a single compiled pass. Codes that are in none of the lists,
+        values that are not integral codes, and nodata, become -9999. A code
+        in several lists takes the medium suitability over the high, and the
+        high over the low.
+
+        Raises:
+            ValueError: if a land cover code of config is negative
+        """
+
+        from .kernels import lookup_codes
+
+        covers = [np.asarray(covers, dtype=np.intp)
+                  for covers in (config.low_suitability_covers,
+                                 config.high_suitability_covers,
+                                 config.medium_suitability_covers)]
+
+        # negative codes would index the lookup table from its end
+        if any((c < 0).any() for c in covers):
+            raise ValueError("Land cover codes must be non negative.")
+
+        size = max([c.max() for c in covers if c.size], default=0) + 1
+
+        # assigned in increasing order of priority
+        lut = np.full(size, -9999, dtype=np.int32)
+        lut[covers[0]] = Suitability.Low.code
+        lut[covers[1]] = Suitability.High.code
+        lut[covers[2]] = Suitability.Medium.code
+
+        # nodata (NaN and -9999) is masked out before the lookup, and codes
+        # out of the lookup table (not in any list) or not integral are set
+        # to -9999, in the same compiled pass
+        values = np.ascontiguousarray(original_array)
+        reclassified_array = np.empty(values.shape, dtype=np.int32)
+        lookup_codes(values.reshape(-1), lut, -9999,
+                     reclassified_array.reshape(-1))
 
         return reclassified_array
 
+    @staticmethod
+    def _overlay(df1: gpd.GeoDataFrame, df2: gpd.GeoDataFrame,
+                 how: str = 'intersection') -> gpd.GeoDataFrame:
+
+        """
+        Same as gpd.overlay(df1, df2, how) for the 'intersection' and
+        'difference' operations, but the overlay (which validates every
+        geometry first) only gets the geometries of df2 whose bounding box
+        intersects one of df1 (and, for intersections, those of df1 that
+        intersect one of df2), found with a single bulk query of the spatial
+        index. The rest cannot change the result.
+        """
+
+        if how not in ('intersection', 'difference'):
+            raise ValueError(f"Unsupported overlay operation: {how}")
+
+        idx1, idx2 = df2.sindex.query(df1.geometry.values)
+
+        if how == 'intersection':
+            df1 = df1.iloc[np.unique(idx1)]
+
+        return gpd.overlay(df1, df2.iloc[np.unique(idx2)], how=how)
+
     def _aoi_within_admin_borders(self, crs) -> gpd.GeoDataFrame:
 
         admin_border: gpd.GeoDataFrame = self._load_region_subregion_polygon(crs)
@@ -914,7 +1195,8 @@ class Project(object):
         if admin_border.crs != crs:
             admin_border = admin_border.to_crs(crs)
 
-        aoi_border_overlay = gpd.overlay(admin_border, self.aoi, how='intersection')
+        aoi_border_overlay = Project._overlay(admin_border, self.aoi,
+                                              how='intersection')
 
         if aoi_border_overlay.shape[0] == 0:
             logger.error("Area of interest not within administrative borders "
@@ -925,6 +1207,10 @@ class Project(object):
 
     def _load_region_subregion_polygon(self, crs) -> gpd.GeoDataFrame:
 
+        sub_region_gdf = self._sub_region_by_crs.get(str(crs))
+        if sub_region_gdf is not None:
+            return sub_region_gdf
+
         if not self.io_handler.address_exists(
              self.io_handler.region_border_path):
             raise FileNotFoundError("Administrative borders for the project "
@@ -934,10 +1220,8 @@ class Project(object):
         region_border_gdf: gpd.GeoDataFrame = self.io_handler.read_vector(
             self.io_handler.region_border_path)
 
-        if region_border_gdf.crs != crs:
-            region_border_gdf = region_border_gdf.to_crs(crs)
-
-        # Filter the GeoDataFrame for sub_region
+        # Filter the GeoDataFrame for sub_region (before reprojecting, so
+        # that only its polygons are reprojected)
         sub_region_gdf = region_border_gdf[
                 region_border_gdf['NAME_1'] == self.sub_region
                 ]
@@ -946,10 +1230,18 @@ class Project(object):
             raise KeyError(f" Invalid subregion ({self.sub_region})"
                            f"for country: {self.country}")
 
+        if sub_region_gdf.crs != crs:
+            sub_region_gdf = sub_region_gdf.to_crs(crs)
+
+        self._sub_region_by_crs[str(crs)] = sub_region_gdf
         return sub_region_gdf
 
     def _load_protected_areas_polygons(self, crs) -> gpd.GeoDataFrame:
 
+        protected_gdf = self._protected_areas_by_crs.get(str(crs))
+        if protected_gdf is not None:
+            return protected_gdf
+
         if not self.io_handler.protected_areas_path.exists():
             raise FileNotFoundError(
                 "The data on protected areas could not be loaded from "
@@ -960,21 +1252,44 @@ class Project(object):
         if protected_gdf.crs != crs:
             protected_gdf = protected_gdf.to_crs(crs)
 
+        self._protected_areas_by_crs[str(crs)] = protected_gdf
         return protected_gdf
 
+    def _aoi_within_raster_extent(self, path: Union[str, Path]) -> bool:
+
+        """
+        Same check as is_polygon_within_raster_extent for the aoi, reading
+        only the raster header. The bounding box of the aoi is computed
+        once per raster CRS, since all the rasters of a dataset share it.
+        """
+
+        raster_bounds, raster_crs = self.io_handler.read_raster_bounds(path)
+
+        crs_key = str(raster_crs)
+        aoi_bounds = self._aoi_bounds_by_crs.get(crs_key)
+        if aoi_bounds is None:
+            aoi_bounds = self.aoi.to_crs(raster_crs).total_bounds
+            self._aoi_bounds_by_crs[crs_key] = aoi_bounds
+
+        return Project._bounds_contain(raster_bounds, aoi_bounds)
+
     @staticmethod
     def is_polygon_within_raster_extent(polygon: gpd.GeoDataFrame,
-                                        raster: xr.DataArray) -> bool:
+                                        raster_bounds: Tuple[float, float,
+                                                             float, float],
+                                        raster_crs: CRS) -> bool:
 
         """
         Check if the bounding box of a polygon is within the raster's bounding
         box.
 
         Parameters:
-        - raster (rioxarray.DataArray): The raster data array.
         - polygon (gpd.GeoDataFrame): A GeoDataFrame containing the
         polygon(s)
         to check.
+        - raster_bounds (Tuple[float, float, float, float]): The raster
+        bounds (left, bottom, right, top).
+        - raster_crs (CRS): The CRS of the raster.
 
         Returns:
         - bool: True if the polygon's bounding box is within the raster's
@@ -982,49 +1297,113 @@ class Project(object):
         box, False otherwise.
         """
 
-        # Get the bounding box of the raster
-        raster_bounds = raster.rio.bounds()
-        raster_bbox = box(raster_bounds[0],
-                          raster_bounds[1],
-                          raster_bounds[2],
-                          raster_bounds[3])
+        # reproject aoi to raster crs (just in case), and get its bounds
+        polygon_bounds = polygon.to_crs(raster_crs).total_bounds
 
-        # reproject aoi to raster crs (just in case)
-        raster_crs = raster.rio.crs
-        polygon_reprojected = polygon.to_crs(raster_crs)
+        # Check if the polygon bounding box is within the raster bounding box
+        return Project._bounds_contain(raster_bounds, polygon_bounds)
 
-        # Get the bounding box of the polygon
-        polygon_bounds = polygon_reprojected.union_all().envelope
-        polygon_bbox = box(polygon_bounds.bounds[0],
-                           polygon_bounds.bounds[1],
-                           polygon_bounds.bounds[2],
-                           polygon_bounds.bounds[3])
+    @staticmethod
+    def _bounds_contain(outer_bounds, inner_bounds) -> bool:
 
-        # Check if the polygon bounding box is within the raster bounding box
-        is_within = raster_bbox.contains(polygon_bbox)
+        """
+        Checks if the (left, bottom, right, top) bounds of a box contain
+        those of another, comparing their coordinates.
+        """
 
-        return is_within
+        return bool(outer_bounds[0] <= inner_bounds[0] and
+                    outer_bounds[1] <= inner_bounds[1] and
+                    outer_bounds[2] >= inner_bounds[2] and
+                    outer_bounds[3] >= inner_bounds[3])
 
-    def calculate_area_of_category(raster: xr.DataArray, categories: int
-                                   ) -> np.float32:
+    @staticmethod
+    def calculate_nan_stats(array: np.ndarray, mask: np.ndarray
+                            ) -> Tuple[float, float, float]:
 
         """
-        Calculates the area of specific categories in a raster. It does not
-        change the units.
+        Calculates the mean, min and max of the array values selected by the
+        mask, ignoring NaNs. The reductions are masked, so the selected
+        values are never copied.
 
         Returns:
-            np.float32: area of the selected categories
+            Tuple[float, float, float]: mean, min and max of the values
         """
 
-        mask = np.isin(raster, categories)
+        # nothing selected (or only NaNs): NaN stats, as the unmasked
+        # reductions of an empty selection give
+        if not mask.any():
+            return np.nan, np.nan, np.nan
+
+        mean = np.nanmean(array, where=mask)
+        min_ = np.nanmin(array, where=mask, initial=np.inf)
+        max_ = np.nanmax(array, where=mask, initial=-np.inf)
+
+        # if all the selected values are NaN (the mean being NaN), the
+        # initial values are all that is left
+        if np.isnan(mean):
+            if min_ == np.inf:
+                min_ = np.nan
+            if max_ == -np.inf:
+                max_ = np.nan
+
+        return float(mean), float(min_), float(max_)
+
+    @staticmethod
+    def calculate_area_of_categories(raster: xr.DataArray,
+                                     categories: List[int]) -> np.ndarray:
+
+        """
+        Calculates the area of each of the categories in a raster: the area
+        of the pixels exactly equal to it. Integer categories are counted all
+        at once, in a single pass. It does not change the units.
+
+        Returns:
+            np.ndarray: area of each of the categories, in the same order
+        """
+
+        categories = np.asarray(categories)
         pixel_size_x = abs(raster.rio.resolution()[0])
         pixel_size_y = abs(raster.rio.resolution()[1])
 
         # Calculate the area of each pixel
         pixel_area = pixel_size_x * pixel_size_y
 
-        masked_pixel_count = np.sum(mask)
+        if categories.size == 0:
+            return np.zeros(0)
+
+        values = np.asarray(raster).ravel()
+
+        lowest, highest = categories.min(), categories.max()
+        if (np.array_equal(categories, np.rint(categories)) and
+                highest - lowest < MAX_BINCOUNT_CATEGORIES):
+            # count the pixels of every integer value between the lowest and
+            # the highest category (NaNs, values out of that range and non
+            # integral values are not counted)
+            in_range = (values >= lowest) & (values <= highest)
+            if values.dtype.kind == 'f':
+                in_range &= values == np.rint(values)
+            counts = np.bincount(
+                (values[in_range] - lowest).astype(np.int64),
+                minlength=int(highest - lowest) + 1)
+            counts = counts[(categories - lowest).astype(np.int64)]
+        else:
+            counts = np.array([np.count_nonzero(values == category)
+                               for category in categories])
 
-        total_masked_area = masked_pixel_count * pixel_area
+        return counts * pixel_area
+
+    @staticmethod
+    def calculate_area_of_category(raster: xr.DataArray, categories: int
+                                   ) -> np.float32:
+
+        """
+        Calculates the area of specific categories in a raster. It does not
+        change the units.
+
+        Returns:
+            np.float32: area of the selected categories
+        """
 
-        return total_masked_area
+        # each category is counted once, even if it is passed several times
+        return np.sum(Project.calculate_area_of_categories(
+            raster, np.unique(categories)))
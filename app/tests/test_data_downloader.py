@@ -0,0 +1,160 @@
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from requests.exceptions import HTTPError
+
+from ..src import data_downloader
+from ..src.data_downloader import DataDownloader
+
+CONTENT = bytes(range(256)) * 40
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None, content=b""):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+
+def fake_range_get(url, headers=None, stream=False, timeout=None):
+    start, end = map(int, headers["Range"][len("bytes="):].split("-"))
+    return FakeResponse(206, content=CONTENT[start:end + 1])
+
+
+def test_download_in_byte_ranges(tmp_path, mocker):
+    mocker.patch.object(
+        data_downloader._session, "head",
+        return_value=FakeResponse(200, {"Content-Length": str(len(CONTENT)),
+                                        "Accept-Ranges": "bytes"}))
+    mock_get = mocker.patch.object(data_downloader._session, "get",
+                                   side_effect=fake_range_get)
+
+    result_path = tmp_path.joinpath("data.tif")
+    assert DataDownloader._parallel_download("https://url", result_path,
+                                             workers=4, part_size=1000)
+
+    assert mock_get.call_count == 11
+    assert result_path.read_bytes() == CONTENT
+
+
+def test_download_without_preallocation(tmp_path, mocker):
+    mocker.patch.object(
+        data_downloader._session, "head",
+        return_value=FakeResponse(200, {"Content-Length": str(len(CONTENT)),
+                                        "Accept-Ranges": "bytes"}))
+    mocker.patch.object(data_downloader._session, "get",
+                        side_effect=fake_range_get)
+    # posix_fallocate is missing on macOS
+    mocker.patch.object(data_downloader.os, "posix_fallocate",
+                        side_effect=AttributeError, create=True)
+
+    result_path = tmp_path.joinpath("data.tif")
+    assert DataDownloader._parallel_download("https://url", result_path,
+                                             workers=4, part_size=1000)
+
+    assert result_path.read_bytes() == CONTENT
+
+
+def test_download_short_range_raises(tmp_path, mocker):
+    mocker.patch.object(
+        data_downloader._session, "head",
+        return_value=FakeResponse(200, {"Content-Length": str(len(CONTENT)),
+                                        "Accept-Ranges": "bytes"}))
+    mocker.patch.object(
+        data_downloader._session, "get",
+        side_effect=lambda *args, **kwargs: FakeResponse(206, content=b"x"))
+
+    result_path = tmp_path.joinpath("data.tif")
+    with pytest.raises(HTTPError):
+        DataDownloader._parallel_download("https://url", result_path,
+                                          workers=4, part_size=1000)
+
+    assert not os.path.exists(result_path)
+
+
+def test_download_falls_back_to_streaming(tmp_path, mocker):
+    mocker.patch.object(data_downloader._session, "head",
+                        return_value=FakeResponse(200, {}))
+    mocker.patch.object(
+        data_downloader._session, "get",
+        return_value=FakeResponse(200, {"Content-Length": str(len(CONTENT))},
+                                  content=CONTENT))
+
+    result_path = tmp_path.joinpath("data.tif")
+    DataDownloader.download_items_from_stac_catalog("https://url",
+                                                    result_path)
+
+    assert result_path.read_bytes() == CONTENT
+
+
+def test_streaming_without_preallocation(tmp_path, mocker):
+    mocker.patch.object(data_downloader._session, "head",
+                        return_value=FakeResponse(200, {}))
+    mocker.patch.object(
+        data_downloader._session, "get",
+        return_value=FakeResponse(200, {"Content-Length": str(len(CONTENT))},
+                                  content=CONTENT))
+    # the filesystem does not support preallocation
+    mocker.patch.object(data_downloader.os, "posix_fallocate",
+                        side_effect=OSError(95, "Operation not supported"),
+                        create=True)
+
+    result_path = tmp_path.joinpath("data.tif")
+    DataDownloader.download_items_from_stac_catalog("https://url",
+                                                    result_path)
+
+    assert result_path.read_bytes() == CONTENT
+
+
+def test_concurrent_downloads_fit_the_connection_pool(tmp_path, mocker):
+    active, peak = 0, 0
+    lock = threading.Lock()
+
+    def fake_download(item_url, result_path):
+        nonlocal active, peak
+        with lock:
+            active += 1
+            peak = max(peak, active)
+        time.sleep(0.01)
+        with lock:
+            active -= 1
+        return True
+
+    mocker.patch.object(DataDownloader, "_parallel_download",
+                        side_effect=fake_download)
+
+    # downloads run from nested thread pools (the data sets and the years)
+    with ThreadPoolExecutor(max_workers=12) as executor:
+        list(executor.map(
+            lambda i: DataDownloader.download_items_from_stac_catalog(
+                "https://url", tmp_path.joinpath(f"{i}.tif")), range(24)))
+
+    assert peak <= data_downloader.MAX_CONCURRENT_DOWNLOADS
+    adapter = data_downloader._session.get_adapter("https://url")
+    assert adapter._pool_maxsize >= (data_downloader.MAX_CONCURRENT_DOWNLOADS *
+                                     data_downloader.DOWNLOAD_WORKERS)
+
+
+def test_get_border_streams_to_file(tmp_path, mocker):
+    response = mocker.MagicMock()
+    response.__enter__.return_value = response
+    response.raw = io.BytesIO(CONTENT)
+    mock_get = mocker.patch.object(data_downloader._session, "get",
+                                   return_value=response)
+
+    border_path = tmp_path.joinpath("admin_border_ARG.geojson")
+    DataDownloader.get_border("ARG", border_path)
+
+    assert mock_get.call_args.kwargs["stream"]
+    assert border_path.read_bytes() == CONTENT
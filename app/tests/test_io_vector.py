@@ -3,29 +3,29 @@ from pathlib import Path
 from geopandas import GeoDataFrame
 
 from ..src.io_vector import (FileReader,
-                             GeoParquetHandler,
-                             ShapefileHandler,
-                             GeoJSONHandler,
-                             KMLHandler)
+                             read_geoparquet,
+                             read_shapefile,
+                             read_geojson,
+                             read_kml)
 
 
 from .conftest import TESTS_DIR, TESTS_DATA_DIR
 
 
-@pytest.mark.parametrize("file_path, expected_handler", [
-    ("data/file.parquet", GeoParquetHandler),
-    ("data/file.shp", ShapefileHandler),
-    ("data/file.geojson", GeoJSONHandler),
-    ("data/file.kml", KMLHandler),
-    (Path("data/file.parquet"), GeoParquetHandler),
-    (Path("data/file.shp"), ShapefileHandler),
-    (Path("data/file.geojson"), GeoJSONHandler),
-    (Path("data/file.kml"), KMLHandler),
+@pytest.mark.parametrize("file_path, expected_reader", [
+    ("data/file.parquet", read_geoparquet),
+    ("data/file.shp", read_shapefile),
+    ("data/file.geojson", read_geojson),
+    ("data/file.kml", read_kml),
+    (Path("data/file.parquet"), read_geoparquet),
+    (Path("data/file.shp"), read_shapefile),
+    (Path("data/file.geojson"), read_geojson),
+    (Path("data/file.kml"), read_kml),
 ])
-def test_get_handler(file_path, expected_handler):
+def test_get_reader(file_path, expected_reader):
     reader = FileReader(file_path)
-    handler = reader._get_handler()
-    assert isinstance(handler, expected_handler), f"Expected {expected_handler}, but got {type(handler)}"
+    read_function = reader._get_reader()
+    assert read_function is expected_reader, f"Expected {expected_reader}, but got {read_function}"
 
 
 def test_file_does_not_exist():
@@ -35,12 +35,13 @@ def test_file_does_not_exist():
         FileReader(file).read()
 
 
-@pytest.mark.parametrize("file_path, handler_class", [
-    (TESTS_DATA_DIR.joinpath("ARG.geojson"), GeoJSONHandler),
+@pytest.mark.parametrize("file_path", [
+    TESTS_DATA_DIR.joinpath("ARG.geojson"),
 ])
-def test_read(file_path, handler_class, mocker):
-    # Mock the read methods to avoid actual file I/O
-    mocker.patch.object(handler_class, 'read', return_value=GeoDataFrame())
+def test_read(file_path, mocker):
+    # Mock the reader functions to avoid actual file I/O
+    mocker.patch.dict(FileReader._readers,
+                      {".geojson": mocker.Mock(return_value=GeoDataFrame())})
 
     reader = FileReader(file_path)
     data = reader.read()
@@ -55,3 +56,45 @@ def test_raise_unknown_file_format():
 
     with pytest.raises(ValueError):
         reader.read()
+
+
+def test_read_kml(tmp_path):
+    kml_file = tmp_path.joinpath("aoi.kml")
+    kml_file.write_text(
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<kml xmlns="http://www.opengis.net/kml/2.2"><Document><Folder>'
+        '<Placemark><name>field</name><Polygon>'
+        '<outerBoundaryIs><LinearRing><coordinates>'
+        '-58,-28,0 -57,-28,0 -57,-27,0 -58,-27,0 -58,-28,0'
+        '</coordinates></LinearRing></outerBoundaryIs>'
+        '<innerBoundaryIs><LinearRing><coordinates>'
+        '-57.6,-27.6 -57.4,-27.6 -57.4,-27.4 -57.6,-27.6'
+        '</coordinates></LinearRing></innerBoundaryIs>'
+        '</Polygon></Placemark>'
+        '<Placemark><name>well</name>'
+        '<Point><coordinates>-57.5,-27.8</coordinates></Point>'
+        '</Placemark>'
+        '</Folder></Document></kml>', encoding="utf-8")
+
+    data = FileReader(kml_file).read()
+
+    assert list(data["name"]) == ["field", "well"]
+    assert list(data.geom_type) == ["Polygon", "Point"]
+    assert len(data.geometry[0].interiors) == 1
+    assert data.crs == "EPSG:4326"
+
+
+def test_read_kml_polygon_without_outer_boundary(tmp_path):
+    kml_file = tmp_path.joinpath("aoi.kml")
+    kml_file.write_text(
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<kml xmlns="http://www.opengis.net/kml/2.2"><Document>'
+        '<Placemark><name>field</name><Polygon>'
+        '<innerBoundaryIs><LinearRing><coordinates>'
+        '-57.6,-27.6 -57.4,-27.6 -57.4,-27.4 -57.6,-27.6'
+        '</coordinates></LinearRing></innerBoundaryIs>'
+        '</Polygon></Placemark>'
+        '</Document></kml>', encoding="utf-8")
+
+    with pytest.raises(ValueError, match="aoi.kml"):
+        FileReader(kml_file).read()
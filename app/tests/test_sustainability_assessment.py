@@ -1,4 +1,12 @@
+import json
+import os
+import subprocess
+import sys
+
+import dask.array as da
+import numpy as np
 import pytest
+import xarray as xr
 
 from .conftest import TESTS_DIR, TESTS_DATA_DIR
 from ..src.suitability_assessment import (Project,
@@ -114,7 +122,7 @@ def test_analyze_land_suitability_full_workflow(temp_project_path, mocker,
     assert mock_get_land_cover_data.call_count == 1
 
     assert temp_project_path.joinpath("results",
-                                      "remaining_land.geojson"
+                                      "remaining_land.parquet"
                                       ).is_file()
     assert temp_project_path.joinpath("results",
                                       "classified_land.tif"
@@ -128,3 +136,202 @@ def test_project_year_type():
         Project(project_name="nice_project",
                 project_year="2025",
                 aoi_path=aoi_path_out)
+
+
+def test_calculate_slope_matches_numpy_gradient():
+    rng = np.random.default_rng(0)
+    elevation = (rng.random((40, 30)) * 100).astype(np.float32)
+    elevation[5, 5] = np.nan
+
+    dzdx = np.gradient(elevation, axis=1) / 30.
+    dzdy = np.gradient(elevation, axis=0) / 30.
+    expected = np.degrees(np.arctan(np.sqrt(dzdx**2 + dzdy**2)))
+
+    slope = Project.calculate_slope(elevation, 30.)
+
+    assert slope.dtype == np.float32
+    np.testing.assert_allclose(slope, expected, rtol=1e-5, atol=1e-4)
+
+
+def _original_threshold_rules(values, config):
+    # frozen copy of the original sequential mask assignments
+    reclassified = np.empty_like(values, dtype="uint8")
+    condition_low = ((values < config.low_threshold) |
+                     (values > config.medium_threshold))
+    condition_high = ((values >= config.low_threshold) &
+                      (values < config.high_threshold))
+    condition_medium = ~condition_low & ~condition_high
+    reclassified[condition_low] = 1
+    reclassified[condition_high] = 3
+    reclassified[condition_medium] = 2
+    return reclassified
+
+
+@pytest.mark.parametrize("rounding", [np.floor, np.ceil, np.round, np.trunc])
+def test_average_and_round_blocks(rounding):
+    rng = np.random.default_rng(0)
+    stack = (rng.random((3, 40, 30)) * 4 - 1).astype(np.float32)
+    stack[1, 5, 5] = np.nan
+
+    expected = stack.mean(axis=0)
+    expected = np.where(expected < 0, -9999, rounding(expected))
+
+    # the stack is averaged block by block, as in land_suitability_analyzer
+    result = da.from_array(stack, chunks=(3, 16, 16)).map_blocks(
+        Project._average_and_round, rounding, nodata=-9999, drop_axis=0,
+        dtype=np.float32).compute()
+
+    assert result.dtype == np.float32
+    np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize("config", [
+    SlopeConfig(low_threshold=1, medium_threshold=5, high_threshold=3),
+    HANDConfig(low_threshold=1, medium_threshold=50, high_threshold=30),
+    SlopeConfig(low_threshold=1, medium_threshold=3, high_threshold=5),
+])
+def test_reclassify_matches_thresholds(config):
+    values = np.array([-np.inf, 0, 0.5, 1, 2, 3, 4, 5, np.nextafter(5, 6), 20,
+                       30, 40, 50, 60, np.inf, np.nan], dtype=np.float32)
+
+    reclassified = Project._reclassify(values, config)
+
+    expected = _original_threshold_rules(values, config)
+    assert reclassified.dtype == np.uint8
+    np.testing.assert_array_equal(reclassified, expected)
+    np.testing.assert_array_equal(
+        Project._classify_by_thresholds(values, config), expected)
+
+
+def test_reclassify_land_cover():
+    values = np.array([[5, 8, 11, np.nan], [2, 5, 11, 8]], dtype=np.float32)
+    config = CoverTypeConfig(low_suitability_covers=[5],
+                             medium_suitability_covers=[8],
+                             high_suitability_covers=[8, 11])
+
+    reclassified = Project._reclassify_land_cover(values, config)
+
+    np.testing.assert_array_equal(reclassified,
+                                  [[1, 2, 3, -9999], [-9999, 1, 3, 2]])
+
+    # the int32 land cover uses -9999 as nodata
+    codes = np.array([[5, -9999], [11, 3]], dtype=np.int32)
+    np.testing.assert_array_equal(
+        Project._reclassify_land_cover(codes, config),
+        [[1, -9999], [3, -9999]])
+
+    # non integral values are not truncated to a code
+    fractions = np.array([5.5, 8.0, 10.7, 11.0], dtype=np.float32)
+    np.testing.assert_array_equal(
+        Project._reclassify_land_cover(fractions, config),
+        [-9999, 2, -9999, 3])
+
+    with pytest.raises(ValueError):
+        Project._reclassify_land_cover(
+            codes, CoverTypeConfig(low_suitability_covers=[-1],
+                                   medium_suitability_covers=[],
+                                   high_suitability_covers=[11]))
+
+
+def test_reclassify_land_cover_blocks_from_threads():
+    # the blocks are reclassified from several dask threads at once, which
+    # aborts the process if the kernel is parallel and numba falls back to
+    # the (not thread safe) workqueue threading layer
+    script = """
+import dask.array as da
+import numpy as np
+from app.src.suitability_assessment import CoverTypeConfig, Project
+
+config = CoverTypeConfig([5], [8], [11])
+codes = np.tile(np.array([5, 8, 11, 3, -9999], dtype=np.int32), (400, 40))
+result = da.from_array(codes, chunks=(25, 200)).map_blocks(
+    Project._reclassify_land_cover, config, dtype=np.int32).compute(
+        num_workers=8)
+expected = np.tile(np.array([1, 2, 3, -9999, -9999]), (400, 40))
+assert (result == expected).all()
+"""
+    env = {**os.environ, "NUMBA_THREADING_LAYER": "workqueue"}
+    completed = subprocess.run([sys.executable, "-c", script],
+                               cwd=TESTS_DIR.parents[1], env=env,
+                               capture_output=True, text=True)
+    assert completed.returncode == 0, completed.stderr
+
+
+def test_calculate_area_of_category_exact_values():
+    raster = xr.DataArray([[1.0, 1.5, 2.9], [np.nan, 3, -9999]],
+                          dims=("y", "x"),
+                          coords={"y": [15., 5.], "x": [5., 15., 25.]})
+
+    assert Project.calculate_area_of_category(raster, [1, 2, 3]) == 200
+    assert Project.calculate_area_of_category(raster, -9999) == 100
+    np.testing.assert_array_equal(
+        Project.calculate_area_of_categories(raster, [3, -9999, 1.5]),
+        [100, 100, 100])
+
+
+@pytest.mark.filterwarnings("ignore:Mean of empty slice")
+def test_calculate_nan_stats_empty_selection():
+    array = np.array([[1., np.nan], [3., np.nan]], dtype=np.float32)
+
+    assert Project.calculate_nan_stats(
+        array, np.array([[True, False], [True, False]])) == (2., 1., 3.)
+    for mask in (np.zeros((2, 2), dtype=bool),
+                 np.array([[False, True], [False, True]])):
+        assert np.isnan(Project.calculate_nan_stats(array, mask)).all()
+
+
+def test_write_stats_keeps_nan(project):
+    project.io_handler._create_dirs()
+
+    stats = Stats(average_slope=(np.float32(np.nan), "%"),
+                  max_slope=(np.float32(2.5), "%"), years=[2020, 2021])
+    project.io_handler.write_stats(stats)
+
+    # NaN stats are written as NaN (not null), as json.dump did
+    with open(project.io_handler.stats_path) as json_file:
+        written = json.load(json_file)
+    assert np.isnan(written["average_slope"][0])
+    assert written["max_slope"] == [2.5, "%"]
+    assert written["years"] == [2020, 2021]
+    assert written["min_slope"] is None
+
+
+def test_get_data_fails_fast_without_protected_areas(temp_project_path,
+                                                     mocker):
+    project = Project(project_name="Corrientes",
+                      project_year=2025,
+                      aoi_path=aoi_path_out,
+                      protected_areas_path=temp_project_path.joinpath(
+                          "missing.geojson"),
+                      administrative_borders_path=borders_path,
+                      project_dir=temp_project_path)
+    mock_dem = mocker.patch.object(DataDownloader,
+                                   "get_dem_planetary_computer")
+
+    with pytest.raises(NotImplementedError):
+        project.get_data()
+
+    mock_dem.assert_not_called()
+
+
+def test_same_grid():
+    def raster(x0, crs="EPSG:32721"):
+        xds = xr.DataArray(np.zeros((3, 4)), dims=("y", "x"),
+                           coords={"y": [15., 5., -5.],
+                                   "x": x0 + np.arange(4) * 10.})
+        return xds.rio.write_crs(crs)
+
+    assert Project._same_grid(raster(5.), raster(5.))
+    assert not Project._same_grid(raster(5.), raster(15.))
+    assert not Project._same_grid(raster(5.), raster(5., "EPSG:4326"))
+    assert not Project._same_grid(raster(5.), raster(5.)[:2])
+
+
+def test_list_existing_paths(tmp_path, project):
+    existing = tmp_path.joinpath("lc_2020.tif")
+    existing.touch()
+    missing = tmp_path.joinpath("lc_2021.tif")
+    missing_dir = tmp_path.joinpath("missing", "lc_2022.tif")
+
+    assert project.io_handler.list_existing_paths(
+        [existing, missing, missing_dir]) == {existing}